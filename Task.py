@@ -1,149 +1,2394 @@
 import pandas as pd
 import numpy as np
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import OperationalError
 from bokeh.plotting import figure, show, output_file
+import hashlib
+import io
+import json
 import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+import sys
+import time
+import uuid
+import tempfile
 import unittest
+from unittest import mock
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the NumPy kernels are used without it
+    njit = None
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-class InvalidSalesDataError(Exception):
-    """
-    Custom exception for handling missing or malformed sales data
-    that prevents further processing in the forecasting workflow.
-    """
-    pass
+class InvalidSalesDataError(Exception):
+    """
+    Custom exception for handling missing or malformed sales data
+    that prevents further processing in the forecasting workflow.
+    """
+    pass
+
+def quote_identifier(name):
+    """
+    Quotes a table or column name for use in SQL statements.
+
+    Args:
+        name (str): Identifier to quote.
+
+    Returns:
+        str: The identifier wrapped in double quotes with embedded quotes escaped.
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+def sse_matrix(train_values, pattern_values, pattern_sq=None):
+    """
+    Computes the sum of squared errors between every training column and every pattern
+    column in one matrix product, using ||a||^2 - 2 a.b + ||b||^2.
+
+    Args:
+        train_values (np.ndarray): Training matrix of shape (rows, training columns).
+        pattern_values (np.ndarray): Pattern matrix of shape (rows, pattern columns).
+        pattern_sq (np.ndarray): Precomputed squared norms of the pattern columns.
+
+    Returns:
+        np.ndarray: SSE matrix of shape (training columns, pattern columns).
+    """
+    train_sq = np.einsum("ij,ij->j", train_values, train_values)
+    if pattern_sq is None:
+        pattern_sq = np.einsum("ij,ij->j", pattern_values, pattern_values)
+    sse = train_sq[:, None] - 2.0 * (train_values.T @ pattern_values) + pattern_sq[None, :]
+    return np.maximum(sse, 0.0)
+
+def _near_candidates(train_values, pattern_values, sse, k=1, pattern_sq=None):
+    """
+    Marks the pattern columns whose SSE from the matrix form may, within its rounding
+    error (in the precision of the inputs), be among the k smallest of a training column.
+
+    Args:
+        train_values (np.ndarray): Training matrix of shape (rows, training columns).
+        pattern_values (np.ndarray): Pattern matrix of shape (rows, pattern columns).
+        sse (np.ndarray): SSE matrix from sse_matrix.
+        k (int): Number of smallest SSE values per training column (at least 1).
+        pattern_sq (np.ndarray): Precomputed squared norms of the pattern columns.
+
+    Returns:
+        np.ndarray: Boolean mask of the shape of sse.
+    """
+    train_sq = np.einsum("ij,ij->j", train_values, train_values)
+    if pattern_sq is None:
+        pattern_sq = np.einsum("ij,ij->j", pattern_values, pattern_values)
+    error = (train_sq[:, None] + pattern_sq[None, :]) * (train_values.shape[0] + 2) * np.finfo(sse.dtype).eps
+    kth_upper = np.partition(sse + error, k - 1, axis=1)[:, [k - 1]]
+    return sse - error <= kth_upper
+
+def argmin_sse(train_values, pattern_values, sse, pattern_sq=None):
+    """
+    Picks the pattern with the smallest SSE for every training column. Candidates whose
+    SSE is within the rounding error of the expanded form (in the precision of the inputs)
+    are re-scored exactly in float64, so the winner (including the first-column rule for
+    ties) matches a direct summation.
+
+    Args:
+        train_values (np.ndarray): Training matrix of shape (rows, training columns).
+        pattern_values (np.ndarray): Pattern matrix of shape (rows, pattern columns).
+        sse (np.ndarray): SSE matrix from sse_matrix.
+        pattern_sq (np.ndarray): Precomputed squared norms of the pattern columns.
+
+    Returns:
+        np.ndarray: Index of the best pattern column for every training column.
+    """
+    near = _near_candidates(train_values, pattern_values, sse, 1, pattern_sq)
+    winners = np.argmin(sse, axis=1)
+    for i in np.flatnonzero(near.sum(axis=1) > 1):
+        candidates = np.flatnonzero(near[i])
+        exact = np.sum((train_values[:, [i]].astype(np.float64) - pattern_values[:, candidates]) ** 2, axis=0)
+        winners[i] = candidates[np.argmin(exact)]
+    return winners
+
+def pruned_argmin_sse(train_values, pattern_values, block_rows=64, batch_size=256, pattern_sq_norms=None,
+                      pattern_sums=None):
+    """
+    Least-squares search that skips most of the work for clearly worse candidates.
+    Candidates are visited in order of the lower bound (||a|| - ||b||)^2 <= SSE, tightened
+    to (sum(a) - sum(b))^2 / rows when pattern sums are given, and
+    their SSE is accumulated in blocks of rows so a candidate is abandoned as soon as
+    its partial sum exceeds the best SSE found so far. Survivors are re-scored by direct
+    summation, so the result is identical to argmin_sse.
+
+    Args:
+        train_values (np.ndarray): Training matrix of shape (rows, training columns).
+        pattern_values (np.ndarray): Pattern matrix of shape (rows, pattern columns).
+        block_rows (int): Rows accumulated before candidates are checked for abandoning.
+        batch_size (int): Candidates evaluated together.
+        pattern_sq_norms (np.ndarray): Precomputed squared norms of the pattern columns.
+        pattern_sums (np.ndarray): Precomputed sums of the pattern columns.
+
+    Returns:
+        np.ndarray: Index of the best pattern column for every training column.
+    """
+    n_rows, n_patterns = pattern_values.shape
+    if pattern_sq_norms is None:
+        pattern_sq_norms = np.einsum("ij,ij->j", pattern_values, pattern_values, dtype=np.float64)
+    pattern_norms = np.sqrt(pattern_sq_norms)
+    eps = np.finfo(float).eps
+
+    winners = np.empty(train_values.shape[1], dtype=int)
+    for i in range(train_values.shape[1]):
+        a = train_values[:, i].astype(np.float64)  # float32 patterns are promoted per block
+        a_sq = float(a @ a)
+        lower = (np.sqrt(a_sq) - pattern_norms) ** 2
+        if pattern_sums is not None and n_rows:
+            # |sum(a) - sum(b)| is shrunk by a bound on its rounding error so the bound stays safe.
+            sum_error = n_rows * eps * np.sqrt(n_rows) * (np.sqrt(a_sq) + pattern_norms)
+            gap = np.maximum(np.abs(a.sum() - pattern_sums) - sum_error, 0.0)
+            lower = np.maximum(lower, gap ** 2 / n_rows)
+        order = np.argsort(lower, kind="stable")
+        best_sse, best_idx = np.inf, -1
+
+        for start in range(0, n_patterns, batch_size):
+            # Slack keeps candidates whose bound or partial sum only exceeds the best by rounding.
+            limit = best_sse * (1 + 1e-9) + 4 * n_rows * eps * a_sq
+            batch = order[start:start + batch_size]
+            batch = batch[lower[batch] <= limit]
+            if not len(batch):
+                break  # bounds are sorted, so every later candidate is pruned as well
+
+            partial = np.zeros(len(batch))
+            for row in range(0, n_rows, block_rows):
+                diff = a[row:row + block_rows, None] - pattern_values[row:row + block_rows, batch]
+                partial += np.einsum("ij,ij->j", diff, diff)
+                keep = partial <= limit
+                if not keep.all():
+                    batch, partial = batch[keep], partial[keep]
+                    if not len(batch):
+                        break
+
+            if len(batch):
+                exact = np.sum((a[:, None] - pattern_values[:, batch]) ** 2, axis=0)
+                j = np.lexsort((batch, exact))[0]
+                if exact[j] < best_sse or (exact[j] == best_sse and batch[j] < best_idx):
+                    best_sse, best_idx = exact[j], batch[j]
+        winners[i] = best_idx
+    return winners
+
+def top_k_sse(train_values, pattern_values, k):
+    """
+    Finds the k patterns with the smallest SSE for every training column. Every column
+    whose SSE from the matrix form may, within its rounding error, be among the k
+    smallest is re-scored by direct summation in float64; the result is ordered by SSE,
+    with the lower pattern column first on ties, so rank 1 is the argmin_sse winner.
+
+    Args:
+        train_values (np.ndarray): Training matrix of shape (rows, training columns).
+        pattern_values (np.ndarray): Pattern matrix of shape (rows, pattern columns).
+        k (int): Number of candidates per training column (capped at the number of patterns).
+
+    Returns:
+        tuple: (pattern indices, SSE values), both of shape (training columns, k).
+
+    Raises:
+        ValueError: If k is negative.
+    """
+    if k < 0:
+        raise ValueError(f"k must be non-negative, got {k}")
+    k = min(k, pattern_values.shape[1])
+    if k == 0:
+        return np.empty((train_values.shape[1], 0), dtype=int), np.empty((train_values.shape[1], 0))
+    sse = sse_matrix(train_values, pattern_values)
+    near = _near_candidates(train_values, pattern_values, sse, k)
+
+    indices = np.empty((sse.shape[0], k), dtype=int)
+    values = np.empty((sse.shape[0], k))
+    for i in range(sse.shape[0]):
+        candidates = np.flatnonzero(near[i])
+        exact = np.sum((train_values[:, [i]].astype(np.float64) - pattern_values[:, candidates]) ** 2, axis=0)
+        order = np.lexsort((candidates, exact))[:k]
+        indices[i], values[i] = candidates[order], exact[order]
+    return indices, values
+
+def _pairwise_loss(train_values, pattern_values, reduce, block_bytes=64 * 2**20):
+    """
+    Evaluates a loss for every training/pattern column pair. Training and pattern columns
+    are processed in blocks sized so that the (rows, training block, pattern block) float64
+    deviation array stays within block_bytes, however many columns are stacked.
+
+    Args:
+        train_values (np.ndarray): Training matrix of shape (rows, training columns).
+        pattern_values (np.ndarray): Pattern matrix of shape (rows, pattern columns).
+        reduce (callable): Maps a deviation block to losses of shape (training block, pattern block).
+        block_bytes (int): Memory budget of one deviation block.
+
+    Returns:
+        np.ndarray: Loss matrix of shape (training columns, pattern columns).
+    """
+    n_rows, n_train = train_values.shape
+    losses = np.empty((n_train, pattern_values.shape[1]))
+    column_bytes = max(n_rows, 1) * 8
+    train_block = max(1, min(n_train, block_bytes // column_bytes))
+    pattern_block = max(1, block_bytes // (column_bytes * train_block))
+    for i in range(0, n_train, train_block):
+        train_part = np.asarray(train_values[:, i:i + train_block], dtype=np.float64)  # deviations are float64
+        for start in range(0, pattern_values.shape[1], pattern_block):
+            diff = train_part[:, :, None] - pattern_values[:, None, start:start + pattern_block]
+            losses[i:i + train_block, start:start + pattern_block] = reduce(diff)
+    return losses
+
+def mae_matrix(train_values, pattern_values):
+    """
+    Computes the sum of absolute errors for every training/pattern column pair.
+
+    Returns:
+        np.ndarray: Loss matrix of shape (training columns, pattern columns).
+    """
+    return _pairwise_loss(train_values, pattern_values, lambda diff: np.abs(diff).sum(axis=0))
+
+def max_abs_matrix(train_values, pattern_values):
+    """
+    Computes the largest absolute error (Chebyshev distance) for every training/pattern column pair.
+
+    Returns:
+        np.ndarray: Loss matrix of shape (training columns, pattern columns).
+    """
+    return _pairwise_loss(train_values, pattern_values, lambda diff: np.abs(diff).max(axis=0, initial=0.0))
+
+def huber_matrix(train_values, pattern_values, delta=1.0):
+    """
+    Computes the Huber loss for every training/pattern column pair: quadratic for
+    deviations up to delta and linear beyond, so single outliers weigh less than in SSE.
+
+    Args:
+        delta (float): Deviation at which the loss switches from quadratic to linear.
+
+    Returns:
+        np.ndarray: Loss matrix of shape (training columns, pattern columns).
+    """
+    def reduce(diff):
+        r = np.abs(diff)
+        return np.where(r <= delta, 0.5 * r ** 2, delta * (r - 0.5 * delta)).sum(axis=0)
+    return _pairwise_loss(train_values, pattern_values, reduce)
+
+def weighted_sse_matrix(train_values, pattern_values, weights):
+    """
+    Computes the row-weighted sum of squared errors for every training/pattern column
+    pair. Scaling both matrices by sqrt(weights) turns it into a plain SSE, so the
+    matrix-product form of sse_matrix applies unchanged.
+
+    Args:
+        weights (array-like): Non-negative weight of every row.
+
+    Returns:
+        np.ndarray: Loss matrix of shape (training columns, pattern columns).
+    """
+    scale = row_weight_scale(weights, train_values.shape[0])
+    return sse_matrix(train_values * scale, pattern_values * scale)
+
+def row_weight_scale(weights, n_rows):
+    """
+    Validates row weights and returns their square roots as a column vector.
+
+    Args:
+        weights (array-like): Non-negative weight of every row.
+        n_rows (int): Expected number of rows.
+
+    Returns:
+        np.ndarray: Array of shape (n_rows, 1).
+
+    Raises:
+        ValueError: If the weights have the wrong length or are negative.
+    """
+    weights = np.asarray(weights, dtype=float)
+    if weights.shape != (n_rows,):
+        raise ValueError(f"Expected {n_rows} row weights, got shape {weights.shape}")
+    if (weights < 0).any():
+        raise ValueError("Row weights must be non-negative")
+    return np.sqrt(weights)[:, None]
+
+# Selection losses by name. Every kernel takes (train_values, pattern_values, **params)
+# and returns the (training columns, pattern columns) loss matrix; further losses can
+# be registered by adding them here.
+LOSS_FUNCTIONS = {
+    "sse": sse_matrix,
+    "mae": mae_matrix,
+    "max_abs": max_abs_matrix,
+    "huber": huber_matrix,
+    "weighted_sse": weighted_sse_matrix,
+}
+
+# Keyword parameters accepted by each loss, mapped to whether they are required.
+# Losses added to LOSS_FUNCTIONS with parameters register them here as well.
+LOSS_PARAMETERS = {
+    "huber": {"delta": False},
+    "weighted_sse": {"weights": True},
+}
+
+def fused_argmin_sse(train_values, pattern_values):
+    """
+    Loop form of the least-squares search for the numba backend. Every pair is summed
+    row by row without temporaries and abandoned once its running sum exceeds the best
+    SSE so far; ties keep the first pattern column. Runs as plain Python without numba.
+
+    Args:
+        train_values (np.ndarray): Training matrix of shape (rows, training columns).
+        pattern_values (np.ndarray): Pattern matrix of shape (rows, pattern columns).
+
+    Returns:
+        np.ndarray: Index of the best pattern column for every training column.
+    """
+    n_rows, n_train = train_values.shape
+    winners = np.zeros(n_train, dtype=np.int64)
+    for i in range(n_train):
+        best = np.inf
+        for j in range(pattern_values.shape[1]):
+            total = 0.0
+            for r in range(n_rows):
+                diff = float(train_values[r, i]) - pattern_values[r, j]
+                total += diff * diff
+                if total > best:
+                    break
+            if total < best:
+                best = total
+                winners[i] = j
+    return winners
+
+def fused_best_match(y_values, pattern_values, found, thresholds):
+    """
+    Loop form of the per-point admissibility check for the numba backend: finds the
+    pattern with the smallest deviation within its threshold for every test point,
+    keeping the first pattern on ties. Runs as plain Python without numba.
+
+    Args:
+        y_values (np.ndarray): Test y values.
+        pattern_values (np.ndarray): Pattern values at the test x values, shape (points, patterns).
+        found (np.ndarray): Boolean mask of points whose x was resolved.
+        thresholds (np.ndarray): Allowed deviation of every pattern.
+
+    Returns:
+        tuple: (best pattern index or -1 when unmatched, deviation or inf when unmatched).
+    """
+    n_points, n_patterns = pattern_values.shape
+    best_idx = np.full(n_points, -1, dtype=np.int64)
+    min_dev = np.full(n_points, np.inf)
+    for p in range(n_points):
+        if not found[p]:
+            continue
+        for j in range(n_patterns):
+            dev = abs(y_values[p] - pattern_values[p, j])
+            if dev <= thresholds[j] and dev < min_dev[p]:
+                min_dev[p] = dev
+                best_idx[p] = j
+    return best_idx, min_dev
+
+# Compiled variants of the fused kernels, or None when numba is not installed.
+NUMBA_KERNELS = None if njit is None else {
+    "argmin_sse": njit(cache=True)(fused_argmin_sse),
+    "best_match": njit(cache=True)(fused_best_match),
+}
+
+def _attach_shared(name, shape, dtype=np.float64):
+    """
+    Attaches to a shared memory block holding a floating point matrix.
+
+    Args:
+        name (str): Name of the shared memory block.
+        shape (tuple): Shape of the matrix.
+        dtype (np.dtype): Element type of the matrix.
+
+    Returns:
+        tuple: (SharedMemory handle, np.ndarray view on the block).
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def _argmin_sse_shard(train_name, train_shape, pattern_name, pattern_shape, start, stop, dtype=np.float64):
+    """
+    Worker task: finds the best pattern among columns [start, stop) for every training column.
+
+    Returns:
+        tuple: (global winner indices, exact SSE of each winner).
+    """
+    train_shm, train_values = _attach_shared(train_name, train_shape, dtype)
+    pattern_shm, pattern_values = _attach_shared(pattern_name, pattern_shape, dtype)
+    try:
+        shard = pattern_values[:, start:stop]
+        local = argmin_sse(train_values, shard, sse_matrix(train_values, shard))
+        winner_sse = np.sum((train_values.astype(np.float64) - shard[:, local]) ** 2, axis=0)
+        return local + start, winner_sse
+    finally:
+        del train_values, pattern_values, shard
+        train_shm.close()
+        pattern_shm.close()
+
+def parallel_argmin_sse(train_values, pattern_values, workers):
+    """
+    Shards the pattern columns across a process pool and reduces the per-shard minima.
+    Both matrices are placed in shared memory once, in the precision of pattern_values,
+    so workers read them without pickling. Ties resolve to the lowest pattern column, exactly like the serial search.
+
+    Args:
+        train_values (np.ndarray): Training matrix of shape (rows, training columns).
+        pattern_values (np.ndarray): Pattern matrix of shape (rows, pattern columns).
+        workers (int): Number of worker processes (and shards).
+
+    Returns:
+        np.ndarray: Index of the best pattern column for every training column.
+    """
+    bounds = np.linspace(0, pattern_values.shape[1], min(workers, pattern_values.shape[1]) + 1).astype(int)
+    dtype = pattern_values.dtype
+    blocks = []
+    try:
+        for values in (train_values, pattern_values):
+            shm = shared_memory.SharedMemory(create=True, size=max(values.size * dtype.itemsize, 1))
+            blocks.append(shm)
+            np.ndarray(values.shape, dtype=dtype, buffer=shm.buf)[:] = values
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_argmin_sse_shard, blocks[0].name, train_values.shape,
+                                blocks[1].name, pattern_values.shape, start, stop, dtype.str)
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    winners, best_sse = results[0]
+    for shard_winners, shard_sse in results[1:]:
+        better = shard_sse < best_sse
+        winners = np.where(better, shard_winners, winners)
+        best_sse = np.where(better, shard_sse, best_sse)
+    return winners
+
+# Per-process state of mapping workers, set up once by _init_mapping_worker.
+_MAPPING_WORKER = {}
+
+def _init_mapping_worker(x_name, x_shape, values_name, values_shape, dtype, columns, backend):
+    """
+    Process pool initializer: attaches the shared pattern grid and values once per worker
+    and builds the predictor used to map chunks. The views are read-only, like the cached
+    matrices they are copied from, so a worker cannot modify the arrays other workers read.
+    """
+    x_shm, x_values = _attach_shared(x_name, x_shape)
+    values_shm, values = _attach_shared(values_name, values_shape, dtype)
+    for view in (x_values, values):
+        view.setflags(write=False)
+    _MAPPING_WORKER["shared"] = (x_shm, values_shm)
+    _MAPPING_WORKER["index"] = SortedXIndex.from_sorted(x_values, values, columns)
+    _MAPPING_WORKER["predictor"] = SalesPredictor(db_name=":memory:", cache_size=0, backend=backend)
+
+def _map_chunk_worker(x_vals, y_vals, thresholds_df, x_match, x_tolerance, assignments, point_offset):
+    """
+    Worker task: maps one chunk of test points against the shared pattern index.
+
+    Returns:
+        tuple: (forecast DataFrame, assignments DataFrame or None).
+    """
+    predictor, index = _MAPPING_WORKER["predictor"], _MAPPING_WORKER["index"]
+    forecast_df = predictor._map_sales_points(x_vals, y_vals, thresholds_df, index, x_match, x_tolerance)
+    assignments_df = None
+    if assignments == "all":
+        assignments_df = predictor._map_all_sales_points(x_vals, y_vals, thresholds_df, index, x_match,
+                                                         x_tolerance, point_offset)
+    return forecast_df, assignments_df
+
+class SortedXIndex:
+    """
+    Sorted index over the x column of a pattern table. It keeps the first occurrence of
+    every x value and the matching pattern values, so whole batches of test x values can
+    be resolved with a single searchsorted call.
+    """
+    MATCH_MODES = ("exact", "nearest", "linear")
+
+    def __init__(self, x_values, values, columns, dtype=np.float64):
+        """
+        Builds the index.
+
+        Args:
+            x_values (array-like): x column of the pattern table.
+            values (np.ndarray): Pattern values of shape (rows, columns) in table row order.
+            columns (list): Names of the pattern columns in values.
+            dtype (np.dtype): Floating point type of the stored pattern values.
+        """
+        self.x, first_rows = np.unique(np.asarray(x_values, dtype=float), return_index=True)
+        self.values = np.asarray(values)[first_rows].astype(dtype, copy=False)
+        self.columns = list(columns)
+
+    @classmethod
+    def from_sorted(cls, x_values, values, columns):
+        """
+        Wraps an already sorted, duplicate-free grid and its values without copying them,
+        e.g. arrays attached from shared memory.
+
+        Args:
+            x_values (np.ndarray): Sorted unique x values.
+            values (np.ndarray): Pattern values of shape (len(x_values), columns).
+            columns (list): Names of the pattern columns in values.
+
+        Returns:
+            SortedXIndex: The index.
+        """
+        index = cls.__new__(cls)
+        index.x, index.values, index.columns = x_values, values, list(columns)
+        return index
+
+    def lookup(self, query_x, mode="exact", tolerance=0.0):
+        """
+        Resolves pattern values for a batch of x values.
+
+        Args:
+            query_x (array-like): x values to look up.
+            mode (str): 'exact' for equal x only, 'nearest' for the closest grid x within
+                tolerance, 'linear' for interpolation between the surrounding grid points
+                (points outside the grid fall back to 'nearest').
+            tolerance (float): Largest accepted distance to a grid x for 'nearest'.
+
+        Returns:
+            tuple: (values of shape (len(query_x), columns), boolean mask of resolved points).
+        """
+        if mode not in self.MATCH_MODES:
+            raise ValueError(f"Unknown x match mode: {mode}")
+        query_x = np.asarray(query_x, dtype=float)
+        n_grid = len(self.x)
+        if n_grid == 0:
+            return np.full((len(query_x), len(self.columns)), np.nan), np.zeros(len(query_x), dtype=bool)
+
+        if mode == "linear" and n_grid > 1:
+            right = np.clip(np.searchsorted(self.x, query_x, side="right"), 1, n_grid - 1)
+            left = right - 1
+            weight = ((query_x - self.x[left]) / (self.x[right] - self.x[left]))[:, None]
+            interpolated = (1.0 - weight) * self.values[left] + weight * self.values[right]
+            inside = (query_x >= self.x[0]) & (query_x <= self.x[-1])
+            nearest, nearest_found = self.lookup(query_x, "nearest", tolerance)
+            return np.where(inside[:, None], interpolated, nearest), inside | nearest_found
+
+        right = np.minimum(np.searchsorted(self.x, query_x), n_grid - 1)
+        if mode == "exact":
+            return self.values[right], self.x[right] == query_x
+
+        left = np.maximum(right - 1, 0)
+        use_left = np.abs(query_x - self.x[left]) <= np.abs(self.x[right] - query_x)
+        pos = np.where(use_left, left, right)
+        return self.values[pos], np.abs(self.x[pos] - query_x) <= tolerance
+
+
+class PatternStats:
+    """
+    Running per-column statistics of a pattern table, updated one chunk of rows at a
+    time so a table can be described while it is streamed in. NaN values are undefined
+    points: every statistic skips them and 'count' records how many values are defined.
+    """
+
+    def __init__(self):
+        """Starts with no columns; the first update fixes them."""
+        self.columns = None
+
+    def update(self, df):
+        """
+        Adds the rows of a wide DataFrame with an 'x' column.
+
+        Args:
+            df (pd.DataFrame): Rows to add; every column other than 'x' is a pattern.
+        """
+        columns = [col for col in df.columns if col != "x"]
+        self.add(df["x"].to_numpy(dtype=float), columns, df[columns].to_numpy(dtype=float))
+
+    def add(self, x_values, columns, values):
+        """
+        Adds rows given as arrays.
+
+        Args:
+            x_values (np.ndarray): x values of the rows.
+            columns (list): Names of the pattern columns in values.
+            values (np.ndarray): Pattern values of shape (rows, columns).
+        """
+        if self.columns is None:
+            self.columns = list(columns)
+            n_cols = len(self.columns)
+            self.count = np.zeros(n_cols, dtype=np.int64)
+            self.norm_sq, self.sum = np.zeros(n_cols), np.zeros(n_cols)
+            self.min, self.x_min = np.full(n_cols, np.inf), np.full(n_cols, np.inf)
+            self.max, self.x_max = np.full(n_cols, -np.inf), np.full(n_cols, -np.inf)
+        defined = ~np.isnan(values)
+        filled = np.where(defined, values, 0.0)
+        x_defined = np.broadcast_to(x_values[:, None], values.shape)
+        self.count += defined.sum(axis=0)
+        self.norm_sq += np.einsum("ij,ij->j", filled, filled)
+        self.sum += filled.sum(axis=0)
+        self.min = np.minimum(self.min, np.min(values, axis=0, where=defined, initial=np.inf))
+        self.max = np.maximum(self.max, np.max(values, axis=0, where=defined, initial=-np.inf))
+        self.x_min = np.minimum(self.x_min, np.min(x_defined, axis=0, where=defined, initial=np.inf))
+        self.x_max = np.maximum(self.x_max, np.max(x_defined, axis=0, where=defined, initial=-np.inf))
+
+    def to_frame(self, token):
+        """
+        Returns the statistics as one row per pattern column.
+
+        Args:
+            token (str): Write token of the described table.
+
+        Returns:
+            pd.DataFrame: Columns function, count, norm_sq, sum, min, max, x_min, x_max and token.
+        """
+        return pd.DataFrame({
+            "function": self.columns, "count": self.count, "norm_sq": self.norm_sq, "sum": self.sum,
+            "min": self.min, "max": self.max, "x_min": self.x_min, "x_max": self.x_max, "token": token,
+        })
+
+class BaseDBHandler:
+    """
+    BaseDBHandler is a foundational class that encapsulates common functionality
+    for interacting with an SQLite database using SQLAlchemy. It provides utility methods
+    to load CSV files into database tables and to retrieve those tables as pandas DataFrames.
+    """
+    # Rough in-memory cost of one CSV cell while parsing and inserting (values, parser and insert buffers).
+    BYTES_PER_CELL = 64
+    # Bound parameters per INSERT statement; 999 is the lowest SQLITE_MAX_VARIABLE_NUMBER in the wild.
+    SQLITE_MAX_VARIABLES = 999
+    # Columns that get an index after every bulk load when present.
+    INDEX_COLUMNS = ("x",)
+    # Storage layouts: one column per function ('wide'), one (function_id, row_id, x, y) row per value
+    # ('long'), or one contiguous binary array per function and written chunk ('blob').
+    LAYOUTS = ("wide", "long", "blob")
+    # NumPy dtype of the arrays stored in 'blob' tables; recorded per row so readers need not know it.
+    BLOB_DTYPE = "<f8"
+    # Catalog of tables stored in a non-wide layout, with their logical column order.
+    LAYOUT_TABLE = "sales_table_layouts"
+    # Random token per table, renewed on every write; it names the memory-mapped matrix sidecars.
+    TOKEN_TABLE = "sales_table_tokens"
+
+    def __init__(self, db_name="weekly_sales_forecast.db", cache_size=16, mmap_matrices=True):
+        """
+        Initializes the database connection using SQLAlchemy.
+
+        Args:
+            db_name (str): Name of the SQLite database file.
+            cache_size (int): Maximum number of tables kept in the in-process read cache.
+            mmap_matrices (bool): Whether full-table matrices are materialized to memory-mapped
+                .npy sidecars next to the database (ignored for in-memory databases).
+        """
+        self.db_name = db_name
+        self.engine = create_engine(f'sqlite:///{self.db_name}')
+        self.cache_size = cache_size
+        self._table_cache = OrderedDict()
+        self.dtype = np.dtype(np.float64)
+        self.matrix_dir = None
+        if mmap_matrices and db_name != ":memory:":
+            self.matrix_dir = os.path.abspath(db_name) + ".matrices"
+
+    def load_csv_to_db(self, file_path, table_name, chunksize=None, memory_budget=None, layout="wide",
+                       on_chunk=None):
+        """
+        Loads data from a CSV file into a specified table in the SQLite database.
+        When a chunk size or memory budget is given, the file is streamed in chunks so
+        peak memory stays bounded regardless of file size.
+
+        Args:
+            file_path (str): Path to the CSV file.
+            table_name (str): Name of the table to create or replace in the database.
+            chunksize (int): Number of rows per chunk for streaming ingestion.
+            memory_budget (int): Approximate bytes per chunk, used to derive the chunk size
+                when chunksize is not given.
+            layout (str): Storage layout, 'wide', 'long' or 'blob' (see write_sales_table).
+            on_chunk (callable): Called with every DataFrame once it has been written, e.g.
+                to aggregate statistics in the same pass over the file.
+
+        Returns:
+            bool: True if the whole file was loaded, False if loading failed (the table may
+                then hold the chunks written before the failure).
+        """
+        try:
+            if chunksize is None and memory_budget is not None:
+                chunksize = self.chunksize_for_budget(file_path, memory_budget)
+
+            if chunksize is None:
+                df = pd.read_csv(file_path)
+                df.columns = [col.strip().lower() for col in df.columns]
+                self.write_sales_table(df, table_name, layout=layout, fast_load=True)
+                if on_chunk is not None:
+                    on_chunk(df)
+            else:
+                self._stream_csv_to_db(file_path, table_name, chunksize, layout, on_chunk)
+            logging.info(f"Data loaded into table: {table_name}")
+            return True
+        except (FileNotFoundError, pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+            logging.error(f"Failed loading CSV: {e}")
+        except Exception as e:
+            logging.exception("Unexpected error during CSV load")
+        return False
+
+    def chunksize_for_budget(self, file_path, memory_budget):
+        """
+        Derives the number of CSV rows per chunk that fits into a memory budget.
+
+        Args:
+            file_path (str): Path to the CSV file.
+            memory_budget (int): Approximate bytes available per chunk.
+
+        Returns:
+            int: Rows per chunk (at least 1).
+        """
+        n_cols = len(pd.read_csv(file_path, nrows=0).columns)
+        return max(1, int(memory_budget) // (max(n_cols, 1) * self.BYTES_PER_CELL))
+
+    def _stream_csv_to_db(self, file_path, table_name, chunksize, layout="wide", on_chunk=None):
+        """
+        Streams a CSV file into a table chunk by chunk. The first chunk replaces the
+        table, later chunks are appended, and every chunk is written in its own transaction.
+
+        Args:
+            file_path (str): Path to the CSV file.
+            table_name (str): Name of the table to create or replace.
+            chunksize (int): Number of rows per chunk.
+            layout (str): Storage layout, 'wide', 'long' or 'blob' (see write_sales_table).
+            on_chunk (callable): Called with every chunk once it has been written.
+
+        Returns:
+            int: Number of rows written.
+        """
+        start = time.perf_counter()
+        total_rows = 0
+        chunks_written = 0
+        for chunk in pd.read_csv(file_path, chunksize=chunksize):
+            chunk.columns = [col.strip().lower() for col in chunk.columns]
+            self.write_sales_table(chunk, table_name, if_exists='replace' if chunks_written == 0 else 'append',
+                                   build_indexes=False, layout=layout, fast_load=True)
+            if on_chunk is not None:
+                on_chunk(chunk)
+            total_rows += len(chunk)
+            chunks_written += 1
+
+        if chunks_written == 0:
+            header = pd.read_csv(file_path, nrows=0)
+            header.columns = [col.strip().lower() for col in header.columns]
+            self.write_sales_table(header, table_name, build_indexes=False, layout=layout, fast_load=True)
+            if on_chunk is not None:
+                on_chunk(header)
+        self.build_table_indexes(table_name)
+
+        elapsed = time.perf_counter() - start
+        rate = total_rows / elapsed if elapsed > 0 else float('inf')
+        logging.info(f"Streamed {total_rows} rows into {table_name} in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+        return total_rows
+
+    def write_sales_table(self, df, table_name, if_exists='replace', build_indexes=True, layout="wide",
+                          fast_load=False):
+        """
+        Writes a DataFrame to a table. SQLite engines use a bulk-load path, other
+        engines fall back to pandas' multi-row to_sql inside a single transaction.
+
+        The 'long' layout stores one (function_id, row_id, x, y) row per value instead of
+        one column per function, which avoids SQLite's column limit for large pattern
+        libraries. The 'blob' layout stores every column (x included) as one BLOB of
+        BLOB_DTYPE values per write, so reading a pattern is a single np.frombuffer call.
+        read_sales_table and read_sales_matrix reassemble both transparently.
+
+        Args:
+            df (pd.DataFrame): Data to write.
+            table_name (str): Name of the target table.
+            if_exists (str): 'replace' to recreate the table or 'append' to add rows.
+            build_indexes (bool): Whether to index INDEX_COLUMNS after the load.
+            layout (str): Storage layout, 'wide', 'long' or 'blob'.
+            fast_load (bool): Relax SQLite journaling and syncing for the write. Meant for
+                bulk ingestion only: a crash during such a write can corrupt the whole file.
+        """
+        if layout not in self.LAYOUTS:
+            raise ValueError(f"Unknown table layout: {layout}")
+        stored_df = df
+        if layout == "long":
+            row_offset = self._next_id(table_name, "row_id") if if_exists == 'append' else 0
+            stored_df = self._to_long_frame(df, row_offset)
+        elif layout == "blob":
+            chunk_id = self._next_id(table_name, "chunk_id") if if_exists == 'append' else 0
+            stored_df = self._to_blob_frame(df, chunk_id)
+
+        # The new write token and layout entry commit in the same transaction as the data.
+        catalog = self._catalog_statements(table_name, layout, list(df.columns))
+        if self.engine.dialect.name == "sqlite":
+            self._bulk_insert_sqlite(stored_df, table_name, if_exists, fast_load, catalog)
+        else:
+            with self.engine.begin() as conn:
+                stored_df.to_sql(table_name, conn, if_exists=if_exists, index=False, method='multi',
+                                 chunksize=max(1, self.SQLITE_MAX_VARIABLES // max(len(stored_df.columns), 1)))
+                for sql, params in catalog:
+                    conn.execute(text(sql), params)
+        self._evict_cached(table_name)
+        if build_indexes:
+            self.build_table_indexes(table_name)
+
+    def _bulk_insert_sqlite(self, df, table_name, if_exists, fast_load=False, catalog=()):
+        """
+        Bulk-loads a DataFrame into SQLite in a single transaction using executemany with
+        multi-row INSERT statements. With fast_load, journaling and syncing are relaxed for
+        the duration of the load and restored afterwards.
+
+        Args:
+            df (pd.DataFrame): Data to write.
+            table_name (str): Name of the target table.
+            if_exists (str): 'replace' or 'append'.
+            fast_load (bool): Whether to relax journaling and syncing.
+            catalog (list): (sql, params) statements committed together with the data.
+        """
+        n_cols = max(len(df.columns), 1)
+        batch_rows = max(1, self.SQLITE_MAX_VARIABLES // n_cols)
+        columns = ", ".join(quote_identifier(col) for col in df.columns)
+        row_params = "(" + ", ".join(["?"] * n_cols) + ")"
+        insert_sql = f"INSERT INTO {quote_identifier(table_name)} ({columns}) VALUES "
+        blob_columns = {col: "BLOB" for col in df.columns
+                        if len(df) and isinstance(df[col].iloc[0], bytes)}
+        create_sql = pd.io.sql.get_schema(df, table_name, dtype=blob_columns or None)
+        if if_exists == 'append':
+            create_sql = create_sql.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1)
+
+        values = df.to_numpy(dtype=object)
+        n_full = len(values) // batch_rows * batch_rows
+
+        raw = self.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            if fast_load:
+                journal_mode = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+                synchronous = cursor.execute("PRAGMA synchronous").fetchone()[0]
+                cursor.execute("PRAGMA journal_mode=MEMORY")
+                cursor.execute("PRAGMA synchronous=OFF")
+            try:
+                cursor.execute("BEGIN")
+                if if_exists == 'replace':
+                    cursor.execute(f"DROP TABLE IF EXISTS {quote_identifier(table_name)}")
+                cursor.execute(create_sql)
+                if n_full:
+                    batches = values[:n_full].reshape(n_full // batch_rows, batch_rows * n_cols)
+                    cursor.executemany(insert_sql + ", ".join([row_params] * batch_rows), batches.tolist())
+                if n_full < len(values):
+                    cursor.executemany(insert_sql + row_params, values[n_full:].tolist())
+                for sql, params in catalog:
+                    cursor.execute(sql, params)
+                raw.commit()
+            except Exception:
+                raw.rollback()
+                raise
+            finally:
+                if fast_load:
+                    cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+                    cursor.execute(f"PRAGMA synchronous={synchronous}")
+        finally:
+            raw.close()
+
+    def _to_long_frame(self, df, row_offset=0):
+        """
+        Converts a wide table (x plus one column per function) into the long layout.
+
+        Args:
+            df (pd.DataFrame): Wide data with an 'x' column.
+            row_offset (int): row_id of the first row, used when appending.
+
+        Returns:
+            pd.DataFrame: Columns function_id, row_id, x, y in function-major order.
+
+        Raises:
+            InvalidSalesDataError: If the data has no 'x' column.
+        """
+        if "x" not in df.columns:
+            raise InvalidSalesDataError("The long layout requires an 'x' column")
+        functions = [col for col in df.columns if col != "x"]
+        n_rows = len(df)
+        return pd.DataFrame({
+            "function_id": np.repeat(np.array(functions, dtype=object), n_rows),
+            "row_id": np.tile(np.arange(row_offset, row_offset + n_rows), len(functions)),
+            "x": np.tile(df["x"].to_numpy(dtype=float), len(functions)),
+            "y": df[functions].to_numpy(dtype=float).T.ravel(),
+        })
+
+    def _to_blob_frame(self, df, chunk_id=0):
+        """
+        Converts a wide table into the blob layout: one row per column holding the
+        column's values as a contiguous BLOB_DTYPE array.
+
+        Args:
+            df (pd.DataFrame): Wide data with an 'x' column.
+            chunk_id (int): Sequence number of this write, used when appending.
+
+        Returns:
+            pd.DataFrame: Columns function_id, chunk_id, dtype, data.
+
+        Raises:
+            InvalidSalesDataError: If the data has no 'x' column.
+        """
+        if "x" not in df.columns:
+            raise InvalidSalesDataError("The blob layout requires an 'x' column")
+        dtype = np.dtype(self.BLOB_DTYPE)
+        return pd.DataFrame({
+            "function_id": list(df.columns),
+            "chunk_id": chunk_id,
+            "dtype": dtype.str,
+            "data": [np.ascontiguousarray(df[col].to_numpy(dtype=dtype)).tobytes() for col in df.columns],
+        })
+
+    def _next_id(self, table_name, id_column):
+        """
+        Returns the next free value of a sequence column, e.g. row_id of a long-layout table.
+
+        Args:
+            table_name (str): Name of the table.
+            id_column (str): Name of the integer sequence column.
+
+        Returns:
+            int: One past the largest stored value (0 if the table does not exist).
+        """
+        if not self.table_exists(table_name):
+            return 0
+        with self.engine.connect() as conn:
+            return conn.execute(text(
+                f"SELECT COALESCE(MAX({quote_identifier(id_column)}) + 1, 0) FROM {quote_identifier(table_name)}"
+            )).scalar()
+
+    def _catalog_statements(self, table_name, layout=None, columns=None):
+        """
+        Builds the catalog updates that accompany a write: a new persistent write token
+        and, when a layout is given, the layout and logical column order of the table.
+        Wide tables are simply removed from the layout catalog.
+
+        Args:
+            table_name (str): Name of the written table.
+            layout (str): Storage layout of the table, or None to renew the token only.
+            columns (list): Logical (wide) column order.
+
+        Returns:
+            list: (sql, params) pairs to execute in the transaction of the write.
+        """
+        statements = [
+            (f"CREATE TABLE IF NOT EXISTS {self.TOKEN_TABLE} (table_name TEXT PRIMARY KEY, token TEXT)", {}),
+            (f"INSERT OR REPLACE INTO {self.TOKEN_TABLE} VALUES (:table_name, :token)",
+             {"table_name": table_name, "token": uuid.uuid4().hex}),
+        ]
+        if layout == "wide":
+            if self.table_exists(self.LAYOUT_TABLE):
+                statements.append((f"DELETE FROM {self.LAYOUT_TABLE} WHERE table_name = :table_name",
+                                   {"table_name": table_name}))
+        elif layout is not None:
+            statements.append((f"CREATE TABLE IF NOT EXISTS {self.LAYOUT_TABLE} "
+                               "(table_name TEXT PRIMARY KEY, layout TEXT, columns TEXT)", {}))
+            statements.append((f"INSERT OR REPLACE INTO {self.LAYOUT_TABLE} VALUES (:table_name, :layout, :columns)",
+                               {"table_name": table_name, "layout": layout, "columns": json.dumps(columns)}))
+        return statements
+
+    def table_layout(self, table_name):
+        """
+        Looks up the storage layout of a table.
+
+        Args:
+            table_name (str): Name of the table.
+
+        Returns:
+            tuple: (layout, logical column list); the column list is None for wide tables.
+        """
+        if not self.table_exists(self.LAYOUT_TABLE):
+            return "wide", None
+        with self.engine.connect() as conn:
+            row = conn.execute(text(f"SELECT layout, columns FROM {self.LAYOUT_TABLE} WHERE table_name = :table_name"),
+                               {"table_name": table_name}).fetchone()
+        return ("wide", None) if row is None else (row[0], json.loads(row[1]))
+
+    def build_table_indexes(self, table_name):
+        """
+        Creates an index on every INDEX_COLUMNS column present in a table, and on
+        (function_id, row_id) or (function_id, chunk_id) for long and blob tables.
+
+        Args:
+            table_name (str): Name of the table to index.
+        """
+        columns = {col["name"].lower() for col in inspect(self.engine).get_columns(table_name)}
+        index_columns = [(col,) for col in self.INDEX_COLUMNS if col in columns]
+        for sequence_column in ("row_id", "chunk_id"):
+            if {"function_id", sequence_column} <= columns:
+                index_columns.append(("function_id", sequence_column))
+        with self.engine.begin() as conn:
+            for cols in index_columns:
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS {quote_identifier(f'ix_{table_name}_' + '_'.join(cols))} "
+                    f"ON {quote_identifier(table_name)} ({', '.join(quote_identifier(col) for col in cols)})"
+                ))
+
+    def table_exists(self, table_name):
+        """
+        Checks whether a table is present in the database.
+
+        Args:
+            table_name (str): Name of the table to look up.
+
+        Returns:
+            bool: True if the table exists.
+        """
+        return inspect(self.engine).has_table(table_name)
+
+    def bump_table_version(self, table_name):
+        """
+        Marks a table as changed by storing a new persistent write token. Cached reads,
+        fingerprints and memory-mapped matrices are keyed by this token, so every handler,
+        in this or any other process, stops using the old contents. Writes made through a
+        handler renew the token in their own transaction; call this directly after writing
+        to the database by other means.
+
+        Args:
+            table_name (str): Name of the table that was written.
+        """
+        with self.engine.begin() as conn:
+            for sql, params in self._catalog_statements(table_name):
+                conn.execute(text(sql), params)
+        self._evict_cached(table_name)
+
+    def _evict_cached(self, table_name):
+        """
+        Drops the cached reads of a table from this handler.
+
+        Args:
+            table_name (str): Name of the table.
+        """
+        for key in [key for key in self._table_cache if key[0] == table_name]:
+            del self._table_cache[key]
+
+    def table_fingerprint(self, table_name):
+        """
+        Identifies the contents of a table. Tables written through a handler are identified
+        by their persistent write token, so no data has to be read. Other tables fall back
+        to a content hash of column names and all values, recomputed on every call because
+        their changes cannot be detected otherwise.
+
+        Args:
+            table_name (str): Name of the table to identify.
+
+        Returns:
+            str: The write token or a hex SHA-256 digest, or None if the table cannot be read.
+        """
+        token = self.table_token(table_name)
+        if token is not None:
+            return token
+        df = self.read_sales_table(table_name)
+        if df is None:
+            return None
+        digest = hashlib.sha256("\x1f".join(df.columns).encode())
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+
+    def _build_select(self, table_name, columns, x_range, x_values, conditions=None, params=None):
+        """
+        Translates a column list and x filters into a parameterized SELECT statement.
+        Large x sets are narrowed with a range predicate in SQL and must be filtered exactly
+        by the caller, which is signalled by returning them as the third element.
+
+        Args:
+            table_name (str): Name of the table to read.
+            columns (tuple): Columns to select or None for all columns.
+            x_range (tuple): Inclusive (low, high) bounds on x or None.
+            x_values (iterable): Exact x values or None.
+            conditions (list): Additional SQL predicates.
+            params (dict): Parameters of the additional predicates.
+
+        Returns:
+            tuple: (sql, params, x values still to be filtered or None).
+        """
+        projection = ", ".join(quote_identifier(col) for col in columns) if columns else "*"
+        conditions, params = list(conditions or []), dict(params or {})
+        if x_range is not None:
+            low, high = x_range
+            if low is not None:
+                conditions.append("x >= :x_low")
+                params["x_low"] = float(low)
+            if high is not None:
+                conditions.append("x <= :x_high")
+                params["x_high"] = float(high)
+
+        pending_x = None
+        if x_values is not None:
+            x_values = np.unique(np.asarray(x_values, dtype=float))
+            if len(x_values) == 0:
+                conditions.append("0")
+            elif len(x_values) <= self.SQLITE_MAX_VARIABLES - len(params):
+                names = [f"x_{i}" for i in range(len(x_values))]
+                conditions.append(f"x IN ({', '.join(':' + name for name in names)})")
+                params.update(zip(names, x_values.tolist()))
+            else:
+                conditions.append("x BETWEEN :x_min AND :x_max")
+                params.update(x_min=float(x_values[0]), x_max=float(x_values[-1]))
+                pending_x = x_values
+                if columns and "x" not in columns:
+                    projection += ", x"
+
+        sql = f"SELECT {projection} FROM {quote_identifier(table_name)}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return sql, params, pending_x
+
+    def read_sales_table(self, table_name, columns=None, x_range=None, x_values=None):
+        """
+        Reads a specified table from the database and returns it as a pandas DataFrame.
+        Column lists and x filters are translated into SQL so only the requested part of
+        the table is materialized; long-layout tables are reassembled into the wide form.
+        Results are kept in an LRU cache keyed by table name, write token and projection,
+        so repeated reads of an unchanged table only query the token. Reads filtered by
+        x_values and reads of tables without a write token (written by other means than a
+        handler, so changes cannot be detected) are not cached.
+
+        Args:
+            table_name (str): Name of the table to read.
+            columns (list): Columns to return; all columns when None.
+            x_range (tuple): Inclusive (low, high) bounds on x; either bound may be None.
+            x_values (iterable): Exact x values to return.
+
+        Returns:
+            pd.DataFrame: DataFrame containing table data or None if error occurs.
+        """
+        columns = tuple(columns) if columns is not None else None
+        x_range = tuple(x_range) if x_range is not None else None
+        key = (table_name, self.table_token(table_name), columns, x_range)
+        cacheable = x_values is None and key[1] is not None
+        if cacheable and key in self._table_cache:
+            self._table_cache.move_to_end(key)
+            return self._table_cache[key].copy()
+
+        try:
+            layout, layout_columns = self.table_layout(table_name)
+            if layout == "wide":
+                df = self._read_wide_frame(table_name, columns, x_range, x_values)
+            else:
+                functions = None if columns is None else [col for col in columns if col != "x"]
+                x, functions, values = self._read_layout_matrix(table_name, layout, layout_columns, functions,
+                                                                x_range, x_values)
+                df = self._frame_from_matrix(x, functions, values, columns)
+        except Exception as e:
+            logging.error(f"Failed to read table {table_name}: {e}")
+            return None
+
+        if cacheable and self.cache_size > 0:
+            self._cache_put(key, df)
+            return df.copy()
+        return df
+
+    def read_sales_matrix(self, table_name, columns=None, dtype=None):
+        """
+        Reads x and the given value columns of a table as dense NumPy arrays: x as float64
+        and the values in the handler's dtype (float64 unless configured otherwise).
+        Long and blob tables are assembled directly without building a wide DataFrame,
+        and wide tables are read without caching the intermediate DataFrame, so the cache
+        holds a single copy of the values in the requested precision. Results are cached
+        like read_sales_table and returned as read-only arrays.
+
+        For file databases the full matrix is also written once to column-major .npy
+        sidecars named after the table's write token; later reads, in this or any other
+        process, memory-map them so all workers share one page-cache copy.
+
+        Args:
+            table_name (str): Name of the table to read.
+            columns (list): Value columns to return; all non-x columns when None.
+            dtype (np.dtype): Floating point type of the values; the handler's dtype when None.
+
+        Returns:
+            tuple: (x array, column names, values of shape (rows, columns)) or None if error occurs.
+        """
+        columns = tuple(columns) if columns is not None else None
+        dtype = np.dtype(dtype or self.dtype)
+        key = (table_name, self.table_token(table_name), "matrix", columns, dtype.str)
+        cacheable = key[1] is not None
+        if cacheable and key in self._table_cache:
+            self._table_cache.move_to_end(key)
+            return self._table_cache[key]
+
+        try:
+            result = self._read_matrix_sidecar(table_name) if self.matrix_dir else None
+            if result is not None and columns is not None:
+                positions = {col: i for i, col in enumerate(result[1])}
+                unknown = [col for col in columns if col not in positions]
+                if unknown:
+                    raise InvalidSalesDataError(f"Unknown columns in {table_name}: {unknown}")
+                result = (result[0], list(columns), result[2][:, [positions[col] for col in columns]])
+            if result is None:
+                result = self._read_matrix_from_db(table_name, columns)
+            if result is None:
+                return None
+            result = (result[0], result[1], result[2].astype(dtype, copy=False))
+        except Exception as e:
+            logging.error(f"Failed to read table {table_name}: {e}")
+            return None
+
+        for array in (result[0], result[2]):
+            array.setflags(write=False)
+        if cacheable and self.cache_size > 0:
+            self._cache_put(key, result)
+        return result
+
+    def _read_matrix_from_db(self, table_name, columns):
+        """
+        Reads x and value columns of a table from the database as float64 arrays.
+
+        Args:
+            table_name (str): Name of the table to read.
+            columns (tuple): Value columns to return; all non-x columns when None.
+
+        Returns:
+            tuple: (x array, column names, values) or None if the table cannot be read.
+        """
+        layout, layout_columns = self.table_layout(table_name)
+        if layout != "wide":
+            return self._read_layout_matrix(table_name, layout, layout_columns, columns)
+        df = self._read_wide_frame(table_name, None if columns is None else ("x",) + tuple(columns), None, None)
+        value_cols = list(df.columns[1:])
+        return df["x"].to_numpy(dtype=float), value_cols, df[value_cols].to_numpy(dtype=float)
+
+    def table_token(self, table_name):
+        """
+        Returns the persistent write token of a table.
+
+        Args:
+            table_name (str): Name of the table.
+
+        Returns:
+            str: The token, or None if the table was never written through a handler.
+        """
+        try:
+            with self.engine.connect() as conn:
+                return conn.execute(text(f"SELECT token FROM {self.TOKEN_TABLE} WHERE table_name = :table_name"),
+                                    {"table_name": table_name}).scalar()
+        except OperationalError:  # no table has been written through a handler yet
+            return None
+
+    def _read_matrix_sidecar(self, table_name):
+        """
+        Memory-maps the full matrix of a table from its .npy sidecars, materializing
+        them from the database first if they do not exist for the current write token.
+
+        Args:
+            table_name (str): Name of the table.
+
+        Returns:
+            tuple: (x, column names, values) backed by read-only memory maps, or None if
+                the table has no write token or is empty.
+        """
+        token = self.table_token(table_name)
+        if token is None:
+            return None
+        prefix = os.path.join(self.matrix_dir, f"{table_name}.{token}")
+        if not os.path.exists(prefix + ".columns.json"):
+            loaded = self._read_matrix_from_db(table_name, None)
+            if loaded is None or loaded[2].size == 0:
+                return loaded
+            self._write_matrix_sidecar(table_name, prefix, loaded)
+        with open(prefix + ".columns.json") as handle:
+            columns = json.load(handle)
+        return (np.load(prefix + ".x.npy", mmap_mode="r"), columns,
+                np.load(prefix + ".values.npy", mmap_mode="r"))
+
+    def _write_matrix_sidecar(self, table_name, prefix, matrix):
+        """
+        Writes a matrix to .npy sidecars. The values are stored column-major so single
+        pattern columns are contiguous on disk; the column list is written last and marks
+        the sidecar as complete. Sidecars of older tokens of the table are removed.
+
+        Args:
+            table_name (str): Name of the table.
+            prefix (str): Path prefix of the sidecar files.
+            matrix (tuple): (x, column names, values) to store.
+        """
+        os.makedirs(self.matrix_dir, exist_ok=True)
+        x, columns, values = matrix
+        for name in os.listdir(self.matrix_dir):
+            if name.startswith(f"{table_name}.") and not os.path.join(self.matrix_dir, name).startswith(prefix):
+                os.remove(os.path.join(self.matrix_dir, name))
+
+        tmp_suffix = f".{os.getpid()}.tmp"
+        for suffix, array in ((".x.npy", np.asarray(x)), (".values.npy", np.asfortranarray(values))):
+            with open(prefix + suffix + tmp_suffix, "wb") as handle:
+                np.save(handle, array)
+            os.replace(prefix + suffix + tmp_suffix, prefix + suffix)
+        with open(prefix + ".columns.json" + tmp_suffix, "w") as handle:
+            json.dump(list(columns), handle)
+        os.replace(prefix + ".columns.json" + tmp_suffix, prefix + ".columns.json")
+
+    def _cache_put(self, key, value):
+        """
+        Stores a value in the LRU table cache and evicts the least recently used entries.
+
+        Args:
+            key (tuple): Cache key starting with (table name, write token).
+            value: DataFrame or matrix tuple to cache.
+        """
+        self._table_cache[key] = value
+        while len(self._table_cache) > self.cache_size:
+            self._table_cache.popitem(last=False)
+
+    def _read_wide_frame(self, table_name, columns, x_range, x_values):
+        """
+        Reads a wide-layout table with column projection and x filters.
+
+        Args:
+            table_name (str): Name of the table to read.
+            columns (tuple): Columns to return or None for all columns.
+            x_range (tuple): Inclusive (low, high) bounds on x or None.
+            x_values (iterable): Exact x values or None.
+
+        Returns:
+            pd.DataFrame: The requested rows and columns.
+        """
+        sql, params, pending_x = self._build_select(table_name, columns, x_range, x_values)
+        df = pd.read_sql(text(sql), self.engine, params=params)
+        df.columns = [col.strip().lower() for col in df.columns]
+        if pending_x is not None:
+            df = df[df["x"].isin(pending_x)].reset_index(drop=True)
+            return df[list(columns)] if columns else df
+        return df
+
+    def _read_layout_matrix(self, table_name, layout, layout_columns, functions=None, x_range=None, x_values=None):
+        """
+        Reads functions from a long or blob table as a dense matrix.
+
+        Args:
+            table_name (str): Name of the table.
+            layout (str): 'long' or 'blob'.
+            layout_columns (list): Logical column order recorded in the layout catalog.
+            functions (list): Functions to return; all functions when None.
+            x_range (tuple): Inclusive (low, high) bounds on x or None.
+            x_values (iterable): Exact x values or None.
+
+        Returns:
+            tuple: (x array, function names, values of shape (rows, functions)).
+        """
+        if layout == "long":
+            return self._read_long_matrix(table_name, layout_columns, functions, x_range, x_values)
+        return self._read_blob_matrix(table_name, layout_columns, functions, x_range, x_values)
+
+    def _read_blob_matrix(self, table_name, layout_columns, functions=None, x_range=None, x_values=None):
+        """
+        Reads functions from a blob table. Every stored chunk is decoded with np.frombuffer,
+        so no per-value conversion happens; x filters are applied to the decoded arrays.
+
+        Args:
+            table_name (str): Name of the blob table.
+            layout_columns (list): Logical column order recorded in the layout catalog.
+            functions (list): Functions to return; all functions when None.
+            x_range (tuple): Inclusive (low, high) bounds on x or None.
+            x_values (iterable): Exact x values or None.
+
+        Returns:
+            tuple: (x array, function names, values of shape (rows, functions)).
+
+        Raises:
+            InvalidSalesDataError: If unknown functions are requested.
+        """
+        all_functions = [col for col in layout_columns if col != "x"]
+        functions = all_functions if functions is None else list(functions)
+        unknown = set(functions) - set(all_functions)
+        if unknown:
+            raise InvalidSalesDataError(f"Unknown columns in {table_name}: {sorted(unknown)}")
+
+        wanted = ["x"] + functions
+        sql = f"SELECT function_id, dtype, data FROM {quote_identifier(table_name)}"
+        params = {}
+        if len(wanted) <= self.SQLITE_MAX_VARIABLES and len(wanted) < len(layout_columns):
+            names = [f"f_{i}" for i in range(len(wanted))]
+            sql += f" WHERE function_id IN ({', '.join(':' + name for name in names)})"
+            params.update(zip(names, wanted))
+        chunks = {name: [] for name in wanted}
+        with self.engine.connect() as conn:
+            for function_id, dtype, data in conn.execute(text(sql + " ORDER BY function_id, chunk_id"), params):
+                if function_id in chunks:
+                    chunks[function_id].append(np.frombuffer(data, dtype=dtype))
+
+        x = np.concatenate(chunks["x"]).astype(float) if chunks["x"] else np.empty(0)
+        values = np.empty((len(x), len(functions)))
+        for j, name in enumerate(functions):
+            values[:, j] = np.concatenate(chunks[name]) if chunks[name] else np.nan
+
+        mask = np.ones(len(x), dtype=bool)
+        if x_range is not None:
+            low, high = x_range
+            if low is not None:
+                mask &= x >= low
+            if high is not None:
+                mask &= x <= high
+        if x_values is not None:
+            mask &= np.isin(x, np.asarray(x_values, dtype=float))
+        if not mask.all():
+            x, values = x[mask], values[mask]
+        return x, functions, values
+
+    def _read_long_matrix(self, table_name, layout_columns, functions=None, x_range=None, x_values=None):
+        """
+        Reads functions from a long-layout table and reshapes them into a dense matrix.
+        Rows arrive ordered by (function_id, row_id), so every function is one contiguous
+        block and the whole result is a single reshape.
+
+        Args:
+            table_name (str): Name of the long-layout table.
+            layout_columns (list): Logical column order recorded in the layout catalog.
+            functions (list): Functions to return; all functions when None.
+            x_range (tuple): Inclusive (low, high) bounds on x or None.
+            x_values (iterable): Exact x values or None.
+
+        Returns:
+            tuple: (x array, function names, values of shape (rows, functions)).
+
+        Raises:
+            InvalidSalesDataError: If unknown functions are requested or the data is not rectangular.
+        """
+        all_functions = [col for col in layout_columns if col != "x"]
+        functions = all_functions if functions is None else list(functions)
+        unknown = set(functions) - set(all_functions)
+        if unknown:
+            raise InvalidSalesDataError(f"Unknown columns in {table_name}: {sorted(unknown)}")
+
+        # With no functions requested only x is needed, which any single function provides.
+        query_functions = functions or all_functions[:1]
+        conditions, params = [], {}
+        if len(query_functions) < len(all_functions) and len(query_functions) <= self.SQLITE_MAX_VARIABLES // 2:
+            names = [f"f_{i}" for i in range(len(query_functions))]
+            conditions.append(f"function_id IN ({', '.join(':' + name for name in names)})")
+            params.update(zip(names, query_functions))
+        sql, params, pending_x = self._build_select(table_name, ("function_id", "row_id", "x", "y"),
+                                                    x_range, x_values, conditions, params)
+        long_df = pd.read_sql(text(sql + " ORDER BY function_id, row_id"), self.engine, params=params)
+        if pending_x is not None:
+            long_df = long_df[long_df["x"].isin(pending_x)]
+
+        ids = long_df["function_id"].to_numpy(dtype=object)
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else np.array([], dtype=int)
+        n_rows = len(ids) // len(starts) if len(starts) else 0
+        if len(starts) and (np.diff(np.r_[starts, len(ids)]) != n_rows).any():
+            raise InvalidSalesDataError(f"Table {table_name} has functions of different lengths")
+
+        if n_rows == 0:
+            return np.empty(0), functions, np.empty((0, len(functions)))
+        blocks = {name: i for i, name in enumerate(ids[starts])}
+        y = long_df["y"].to_numpy(dtype=float).reshape(len(starts), n_rows)
+        x = long_df["x"].to_numpy(dtype=float)[:n_rows]
+        return x, functions, y[[blocks[name] for name in functions]].T
+
+    def _frame_from_matrix(self, x, functions, values, columns=None):
+        """
+        Builds a wide DataFrame from x and a function matrix.
+
+        Args:
+            x (np.ndarray): x values.
+            functions (list): Names of the columns in values.
+            values (np.ndarray): Values of shape (rows, functions).
+            columns (tuple): Requested column order; x followed by all functions when None.
+
+        Returns:
+            pd.DataFrame: The wide table.
+        """
+        data = {"x": x}
+        data.update(zip(functions, values.T))
+        order = list(columns) if columns is not None else ["x"] + list(functions)
+        return pd.DataFrame({col: data[col] for col in order})
+
+class SalesPredictor(BaseDBHandler):
+    """
+    SalesPredictor extends BaseDBHandler to implement a forecasting system
+    for weekly sales. It selects the most suitable ideal functions based on
+    historical data using least-squares error (or another loss from LOSS_FUNCTIONS)
+    and maps test data accordingly.
+    """
+    SEARCH_METHODS = ("matrix", "pruned")
+    BACKENDS = ("numpy", "numba")
+    PRECISIONS = ("float64", "float32")
+    # Losses that reduce to a plain SSE and can use the pruned and sharded searches.
+    SSE_LOSSES = ("sse", "weighted_sse")
+    # Losses that append_sales_history can update from per-pair accumulators.
+    INCREMENTAL_LOSSES = ("sse", "max_abs")
+    ACCUMULATOR_TABLE = "pattern_accumulators"
+    STATS_TABLE = "sales_patterns_stats"
+    ASSIGNMENT_MODES = ("best", "all")
+    ASSIGNMENT_TABLE = "sales_forecast_assignments"
+
+    def __init__(self, db_name="weekly_sales_forecast.db", cache_size=16, workers=1, mmap_matrices=True,
+                 search="matrix", loss="sse", loss_params=None, align="exact", align_tolerance=0.0,
+                 backend="numpy", precision="float64"):
+        """
+        Initializes the predictor and its pattern index cache.
+
+        Args:
+            db_name (str): Name of the SQLite database file.
+            cache_size (int): Maximum number of tables kept in the in-process read cache.
+            workers (int): Number of processes used to search the pattern library and to
+                map test chunks; 1 runs both in-process.
+            mmap_matrices (bool): Whether full-table matrices are shared through memory-mapped sidecars.
+            search (str): 'matrix' computes the full SSE matrix, 'pruned' abandons candidates
+                early using lower bounds and partial sums. Both select the same patterns.
+            loss (str): Selection criterion, a key of LOSS_FUNCTIONS.
+            loss_params (dict): Keyword arguments of the loss, e.g. {'delta': 2.0} for 'huber'
+                or {'weights': [...]} for 'weighted_sse'.
+            align (str): How training x values are matched to the pattern grid before
+                selection: 'exact' fails unless every training x is on the grid, 'nearest'
+                accepts the closest grid x within align_tolerance, 'linear' interpolates.
+            align_tolerance (float): Largest accepted x distance for 'nearest' alignment.
+            backend (str): 'numpy' for the array kernels or 'numba' for the compiled loop
+                kernels of the in-process SSE search and the test point mapping. Falls back
+                to 'numpy' when numba is not installed.
+            precision (str): Floating point type of the cached training and pattern matrices.
+                'float32' halves their memory; values are rounded once on load and losses are
+                still evaluated in float64, so results only differ from 'float64' within that rounding.
+        """
+        super().__init__(db_name=db_name, cache_size=cache_size, mmap_matrices=mmap_matrices)
+        if search not in self.SEARCH_METHODS:
+            raise ValueError(f"Unknown search method: {search}")
+        if loss not in LOSS_FUNCTIONS:
+            raise ValueError(f"Unknown loss: {loss}")
+        if search == "pruned" and loss not in self.SSE_LOSSES:
+            raise ValueError(f"The pruned search only supports the losses {self.SSE_LOSSES}")
+        if align not in SortedXIndex.MATCH_MODES:
+            raise ValueError(f"Unknown x match mode: {align}")
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
+        if backend == "numba" and NUMBA_KERNELS is None:
+            logging.warning("numba is not installed, using the numpy backend.")
+            backend = "numpy"
+        self.workers = workers
+        self.search = search
+        self.loss = loss
+        self.loss_params = self._validate_loss_params(loss, dict(loss_params or {}))
+        self.align = align
+        self.align_tolerance = align_tolerance
+        self.backend = backend
+        self.precision = precision
+        self.dtype = np.dtype(precision)
+        self._pattern_index = (None, None)
+
+    @staticmethod
+    def _validate_loss_params(loss, loss_params):
+        """
+        Checks loss parameters against LOSS_PARAMETERS.
+
+        Args:
+            loss (str): Name of the loss.
+            loss_params (dict): Keyword arguments of the loss.
+
+        Returns:
+            dict: The parameters.
+
+        Raises:
+            ValueError: If a parameter is unknown, missing or invalid for the loss.
+        """
+        accepted = LOSS_PARAMETERS.get(loss, {})
+        unknown = sorted(set(loss_params) - set(accepted))
+        if unknown:
+            raise ValueError(f"Unknown parameters for loss '{loss}': {unknown}")
+        missing = [name for name, required in accepted.items() if required and name not in loss_params]
+        if missing:
+            raise ValueError(f"Missing parameters for loss '{loss}': {missing}")
+        if "weights" in loss_params:
+            row_weight_scale(loss_params["weights"], np.size(loss_params["weights"]))
+        if "delta" in loss_params and not loss_params["delta"] > 0:
+            raise ValueError("Huber delta must be positive")
+        return loss_params
+
+    def identify_best_sales_patterns(self):
+        """
+        Determines the best matching ideal function for each historical sales column
+        by minimizing the configured loss (least squares error by default), using the
+        configured search (see _search_patterns). The selection, its SSE values
+        and the allowed deviation of every selected pair are stored in the
+        'pattern_thresholds' table together with a fingerprint of both input tables, and
+        reused as long as the fingerprint matches.
+
+        Returns:
+            dict: Mapping of historical sales columns to ideal function columns.
+        """
+        fingerprint = self.selection_fingerprint()
+        stored = self._stored_selection(fingerprint)
+        if stored is not None:
+            logging.info("Reusing stored pattern selection for unchanged sales data.")
+            return dict(zip(stored["training_column"], stored["ideal_function"]))
+
+        try:
+            aligned = self.read_aligned_matrices()
+        except InvalidSalesDataError as ve:
+            logging.error(f"Validation error: {ve}")
+            return {}
+        if aligned is None:
+            logging.error("Missing historical or pattern sales data.")
+            return {}
+
+        week_cols, train_values, pattern_cols, pattern_values = aligned
+        if not pattern_cols:
+            logging.error("No pattern columns available for selection.")
+            return {}
+
+        try:
+            winners = self._search_patterns(train_values, pattern_values,
+                                            self.pattern_search_stats(self.read_sales_matrix("historical_sales")[0]))
+        except InvalidSalesDataError as ve:
+            logging.error(f"Validation error: {ve}")
+            return {}
+        best_patterns = {week_col: pattern_cols[idx] for week_col, idx in zip(week_cols, winners)}
+
+        thresholds_df = self.compute_pattern_thresholds(week_cols, train_values, pattern_cols, pattern_values, winners)
+        thresholds_df.insert(2, "sse", np.sum((train_values.astype(np.float64) - pattern_values[:, winners]) ** 2,
+                                              axis=0))
+        thresholds_df["fingerprint"] = fingerprint
+        self.write_sales_table(thresholds_df, "pattern_thresholds")
+
+        return best_patterns
+
+    def identify_top_sales_patterns(self, k=3, store=False):
+        """
+        Determines the k best matching ideal functions for each historical sales column,
+        ranked by least squares error.
+
+        Args:
+            k (int): Number of candidates per historical sales column.
+            store (bool): Whether to store the result in the 'sales_pattern_candidates' table.
+
+        Returns:
+            pd.DataFrame: Columns training_column, rank (1 = best), ideal_function, sse,
+                or None if the sales data is missing.
+
+        Raises:
+            ValueError: If k is negative.
+        """
+        try:
+            aligned = self.read_aligned_matrices()
+        except InvalidSalesDataError as ve:
+            logging.error(f"Validation error: {ve}")
+            return None
+        if aligned is None or not aligned[2]:
+            logging.error("Missing historical or pattern sales data.")
+            return None
+
+        week_cols, train_values, pattern_cols, pattern_values = aligned
+        indices, sse = top_k_sse(train_values, pattern_values, k)
+        k = indices.shape[1]
+        candidates_df = pd.DataFrame({
+            "training_column": np.repeat(np.array(week_cols, dtype=object), k),
+            "rank": np.tile(np.arange(1, k + 1), len(week_cols)),
+            "ideal_function": np.array(pattern_cols, dtype=object)[indices.ravel()],
+            "sse": sse.ravel(),
+        })
+        if store:
+            self.write_sales_table(candidates_df, "sales_pattern_candidates")
+        return candidates_df
+
+    def identify_store_sales_patterns(self, stores, table_name="store_pattern_thresholds"):
+        """
+        Selects patterns for the training data of many stores against one shared pattern
+        library. The pattern table is loaded once, the training columns of all stores on
+        the same x grid are stacked side by side and searched in a single matrix
+        computation, and the per-store selections and thresholds are written to one table.
+
+        Args:
+            stores (dict | pd.DataFrame): Mapping of store id to a training DataFrame or the
+                name of a training table, or one tall DataFrame with a 'store_id' column.
+            table_name (str): Table receiving the columns store_id, training_column,
+                ideal_function, sse and threshold.
+
+        Returns:
+            dict: Mapping of store id to its mapping of training columns to ideal functions.
+                Stores whose training data is missing or cannot be searched, e.g. an x grid
+                off the pattern grid or a grid that does not fit the 'weighted_sse' weights,
+                are logged and left out; the other stores are still selected and written.
+        """
+        patterns = self.read_sales_matrix("sales_patterns")
+        if patterns is None or not patterns[1]:
+            logging.error("Missing pattern sales data.")
+            return {}
+        pattern_x, pattern_cols, all_pattern_values = patterns
+        if isinstance(stores, pd.DataFrame):
+            # Columns a store does not have are all-NaN in the tall table.
+            stores = {store_id: group.drop(columns="store_id").dropna(axis=1, how="all")
+                      for store_id, group in stores.groupby("store_id", sort=False)}
+
+        # Stores sampled on the same x grid share one stacked training matrix.
+        grids = {}
+        for store_id, training in stores.items():
+            if isinstance(training, str):
+                training = self.read_sales_table(training)
+            if training is None or "x" not in training.columns:
+                logging.error(f"Validation error: Missing training data for store {store_id}")
+                continue
+            x_values = training["x"].to_numpy(dtype=float)
+            week_cols = [col for col in training.columns if col != "x"]
+            _, labels, blocks = grids.setdefault(x_values.tobytes(), (x_values, [], []))
+            labels.extend((store_id, col) for col in week_cols)
+            blocks.append(training[week_cols].to_numpy(dtype=self.dtype))
+
+        # A grid that cannot be searched only drops its own stores from the batch.
+        frames = []
+        for x_values, labels, blocks in grids.values():
+            try:
+                if np.array_equal(x_values, pattern_x):
+                    pattern_values = all_pattern_values.astype(self.dtype, copy=False)
+                else:
+                    pattern_values = self._align_pattern_values(x_values)
+                train_values = np.hstack(blocks)
+                winners = self._search_patterns(train_values, pattern_values, self.pattern_search_stats(x_values))
+            except (InvalidSalesDataError, ValueError) as ve:
+                failed = list(dict.fromkeys(store_id for store_id, _ in labels))
+                logging.error(f"Validation error for stores {failed}: {ve}")
+                continue
+            frame = self.compute_pattern_thresholds([col for _, col in labels], train_values,
+                                                    pattern_cols, pattern_values, winners)
+            frame.insert(0, "store_id", [store_id for store_id, _ in labels])
+            frame.insert(3, "sse", np.sum((train_values.astype(np.float64) - pattern_values[:, winners]) ** 2,
+                                          axis=0))
+            frames.append(frame)
+        if not frames:
+            return {}
+
+        store_order = {store_id: position for position, store_id in enumerate(stores)}
+        result_df = pd.concat(frames, ignore_index=True)
+        result_df = result_df.iloc[np.argsort(result_df["store_id"].map(store_order).to_numpy(), kind="stable")]
+        self.write_sales_table(result_df.reset_index(drop=True), table_name)
+        logging.info(f"Selected patterns for {result_df['store_id'].nunique()} stores "
+                     f"in {len(frames)} stacked searches.")
+        return {store_id: dict(zip(group["training_column"], group["ideal_function"]))
+                for store_id, group in result_df.groupby("store_id", sort=False)}
+
+    def append_sales_history(self, df):
+        """
+        Appends new rows to 'historical_sales' and updates the pattern selection without
+        rescanning the existing history. The SSE and largest absolute deviation of every
+        historical/pattern column pair are kept in the 'pattern_accumulators' table; new
+        rows only add their own contributions, so an update costs O(new rows x patterns).
+        The accumulators are keyed by the selection fingerprint, which is derived from the
+        write tokens of both tables, so checking them never rereads the history.
+        The accumulators are built with one full pass the first time, and again whenever
+        they no longer match the stored data. Losses outside INCREMENTAL_LOSSES fall back
+        to a full selection.
+
+        Args:
+            df (pd.DataFrame): New rows with x and the historical sales columns.
+
+        Returns:
+            dict: Mapping of historical sales columns to ideal function columns.
+        """
+        df = df.copy()
+        df.columns = [col.strip().lower() for col in df.columns]
+        layout, _ = self.table_layout("historical_sales")
+
+        if self.loss not in self.INCREMENTAL_LOSSES:
+            self.write_sales_table(df, "historical_sales", if_exists='append', layout=layout)
+            return self.identify_best_sales_patterns()
+
+        try:
+            accumulators = self._read_accumulators(self.selection_fingerprint())
+            if accumulators is None:
+                aligned = self.read_aligned_matrices()
+                if aligned is None or not aligned[2]:
+                    logging.error("Missing historical or pattern sales data.")
+                    return {}
+                week_cols, train_values, pattern_cols, pattern_values = aligned
+                sse = _pairwise_loss(train_values, pattern_values, lambda diff: (diff ** 2).sum(axis=0))
+                max_abs = max_abs_matrix(train_values, pattern_values)
+            else:
+                week_cols, pattern_cols, sse, max_abs = accumulators
+
+            if sorted(df.columns) != sorted(["x"] + list(week_cols)):
+                raise InvalidSalesDataError(f"Expected columns {['x'] + list(week_cols)}, got {list(df.columns)}")
+            new_x = df["x"].to_numpy(dtype=float)
+            new_values = df[list(week_cols)].to_numpy(dtype=self.dtype)
+            new_patterns = self._align_pattern_values(new_x)
+        except InvalidSalesDataError as ve:
+            logging.error(f"Validation error: {ve}")
+            return {}
+
+        sse = sse + _pairwise_loss(new_values, new_patterns, lambda diff: (diff ** 2).sum(axis=0))
+        max_abs = np.maximum(max_abs, max_abs_matrix(new_values, new_patterns))
+        self.write_sales_table(df[["x"] + list(week_cols)], "historical_sales", if_exists='append', layout=layout)
+        fingerprint = self.selection_fingerprint()
 
-class BaseDBHandler:
-    """
-    BaseDBHandler is a foundational class that encapsulates common functionality
-    for interacting with an SQLite database using SQLAlchemy. It provides utility methods
-    to load CSV files into database tables and to retrieve those tables as pandas DataFrames.
-    """
-    def __init__(self, db_name="weekly_sales_forecast.db"):
+        winners = np.argmin(sse if self.loss == "sse" else max_abs, axis=1)
+        rows = np.arange(len(week_cols))
+        thresholds_df = pd.DataFrame({
+            "training_column": list(week_cols),
+            "ideal_function": [pattern_cols[idx] for idx in winners],
+            "sse": sse[rows, winners],
+            "threshold": max_abs[rows, winners] * np.sqrt(2),
+            "fingerprint": fingerprint,
+        })
+        self.write_sales_table(thresholds_df, "pattern_thresholds")
+        self.write_sales_table(pd.DataFrame({
+            "training_column": np.repeat(np.array(week_cols, dtype=object), len(pattern_cols)),
+            "ideal_function": np.tile(np.array(pattern_cols, dtype=object), len(week_cols)),
+            "sse": sse.ravel(),
+            "max_abs": max_abs.ravel(),
+            "fingerprint": fingerprint,
+        }), self.ACCUMULATOR_TABLE)
+        logging.info(f"Updated pattern selection with {len(df)} new historical rows.")
+        return dict(zip(thresholds_df["training_column"], thresholds_df["ideal_function"]))
+
+    def read_aligned_matrices(self):
         """
-        Initializes the database connection using SQLAlchemy.
+        Joins the historical and pattern tables on x. Every training row is paired with
+        the pattern values at its x through a sorted merge on the pattern grid, using the
+        predictor's align mode. When both tables share the same x column the matrices are
+        used as they are. The result is cached until either table is rewritten, unless a
+        table has no write token (see read_sales_table).
+
+        Returns:
+            tuple: (training columns, training values, pattern columns, pattern values
+                aligned to the training rows) or None if a table cannot be read.
+
+        Raises:
+            InvalidSalesDataError: If training x values cannot be matched to the pattern grid.
+        """
+        key = ("historical_sales", self.table_token("historical_sales"), "aligned",
+               self.table_token("sales_patterns"), self.align, self.align_tolerance)
+        cacheable = key[1] is not None and key[3] is not None
+        if cacheable and key in self._table_cache:
+            self._table_cache.move_to_end(key)
+            return self._table_cache[key]
+
+        training = self.read_sales_matrix("historical_sales")
+        patterns = self.read_sales_matrix("sales_patterns")
+        if training is None or patterns is None:
+            return None
+
+        train_x, week_cols, train_values = training
+        pattern_x, pattern_cols, pattern_values = patterns
+        if not np.array_equal(train_x, pattern_x):
+            pattern_values = self._align_pattern_values(train_x)
+            logging.info(f"Aligned {len(train_x)} training rows to the pattern grid on x.")
+        train_values = train_values.astype(self.dtype, copy=False)
+        pattern_values = pattern_values.astype(self.dtype, copy=False)
+        for values in (train_values, pattern_values):
+            values.setflags(write=False)
+
+        result = (week_cols, train_values, pattern_cols, pattern_values)
+        if cacheable and self.cache_size > 0:
+            self._cache_put(key, result)
+        return result
+
+    def _align_pattern_values(self, x_values):
+        """
+        Looks up the values of all pattern columns at the given x values. The index over
+        the full pattern table is cached until 'sales_patterns' is rewritten.
 
         Args:
-            db_name (str): Name of the SQLite database file.
+            x_values (np.ndarray): x values of training rows.
+
+        Returns:
+            np.ndarray: Pattern values of shape (len(x_values), pattern columns).
+
+        Raises:
+            InvalidSalesDataError: If x values cannot be matched to the pattern grid.
         """
-        self.db_name = db_name
-        self.engine = create_engine(f'sqlite:///{self.db_name}')
+        key = ("sales_patterns", self.table_token("sales_patterns"), "x_index")
+        index = self._table_cache.get(key) if key[1] is not None else None
+        if index is None:
+            pattern_x, pattern_cols, pattern_values = self.read_sales_matrix("sales_patterns")
+            index = SortedXIndex(pattern_x, pattern_values, pattern_cols, self.dtype)
+            if key[1] is not None and self.cache_size > 0:
+                self._cache_put(key, index)
+
+        values, found = index.lookup(x_values, self.align, self.align_tolerance)
+        if not found.all():
+            missing = np.asarray(x_values)[~found]
+            raise InvalidSalesDataError(
+                f"{len(missing)} training x values are not on the pattern grid "
+                f"(align='{self.align}'), e.g. {missing[:5].tolist()}")
+        return values
 
-    def load_csv_to_db(self, file_path, table_name):
+    def _search_patterns(self, train_values, pattern_values, pattern_stats=None):
         """
-        Loads data from a CSV file into a specified table in the SQLite database.
+        Runs the least-squares search in-process (full matrix, pruned or the numba loop
+        kernel) or sharded across worker processes. Weighted SSE is searched the same way
+        on rows scaled by sqrt(weight); other losses pick the first column with the
+        smallest loss.
 
         Args:
-            file_path (str): Path to the CSV file.
-            table_name (str): Name of the table to create or replace in the database.
+            train_values (np.ndarray): Training matrix of shape (rows, training columns).
+            pattern_values (np.ndarray): Pattern matrix of shape (rows, pattern columns).
+            pattern_stats (dict): Precomputed 'norm_sq' and 'sum' arrays of the pattern
+                columns (see pattern_search_stats), used instead of recomputing them.
+
+        Returns:
+            np.ndarray: Index of the best pattern column for every training column.
         """
-        try:
-            df = pd.read_csv(file_path)
-            df.columns = [col.strip().lower() for col in df.columns]
-            df.to_sql(table_name, self.engine, if_exists='replace', index=False)
-            logging.info(f"Data loaded into table: {table_name}")
-        except (FileNotFoundError, pd.errors.EmptyDataError, pd.errors.ParserError) as e:
-            logging.error(f"Failed loading CSV: {e}")
-        except Exception as e:
-            logging.exception("Unexpected error during CSV load")
+        if self.loss not in self.SSE_LOSSES:
+            return np.argmin(LOSS_FUNCTIONS[self.loss](train_values, pattern_values, **self.loss_params), axis=1)
+        if self.loss == "weighted_sse":
+            try:
+                scale = row_weight_scale(self.loss_params["weights"], train_values.shape[0])
+            except ValueError as e:
+                raise InvalidSalesDataError(str(e))
+            scale = scale.astype(pattern_values.dtype)
+            train_values, pattern_values = train_values * scale, pattern_values * scale
+            pattern_stats = None
+        if self.workers > 1 and pattern_values.shape[1] > 1:
+            return parallel_argmin_sse(train_values, pattern_values, self.workers)
+        pattern_stats = pattern_stats or {}
+        if self.search == "pruned":
+            return pruned_argmin_sse(train_values, pattern_values, pattern_sq_norms=pattern_stats.get("norm_sq"),
+                                     pattern_sums=pattern_stats.get("sum"))
+        if self.backend == "numba":
+            return NUMBA_KERNELS["argmin_sse"](train_values, pattern_values)
+        pattern_sq = pattern_stats.get("norm_sq")
+        return argmin_sse(train_values, pattern_values, sse_matrix(train_values, pattern_values, pattern_sq),
+                          pattern_sq)
 
-    def read_sales_table(self, table_name):
+    def compute_pattern_thresholds(self, week_cols, train_values, pattern_cols, pattern_values, winners):
         """
-        Reads a specified table from the database and returns it as a pandas DataFrame.
+        Computes the allowed deviation for every selected pattern: the largest absolute
+        deviation between the historical column and its pattern, multiplied by sqrt(2).
 
         Args:
-            table_name (str): Name of the table to read.
+            week_cols (list): Historical sales column names.
+            train_values (np.ndarray): Training matrix of shape (rows, training columns).
+            pattern_cols (list): Pattern column names.
+            pattern_values (np.ndarray): Pattern matrix of shape (rows, pattern columns).
+            winners (np.ndarray): Index of the selected pattern for every training column.
 
         Returns:
-            pd.DataFrame: DataFrame containing table data or None if error occurs.
+            pd.DataFrame: Columns training_column, ideal_function, threshold in selection order.
         """
-        try:
-            df = pd.read_sql(f'SELECT * FROM {table_name}', self.engine)
-            df.columns = [col.strip().lower() for col in df.columns]
-            return df
-        except Exception as e:
-            logging.error(f"Failed to read table {table_name}: {e}")
+        max_dev = np.max(np.abs(train_values.astype(np.float64) - pattern_values[:, winners]), axis=0, initial=0.0)
+        return pd.DataFrame({
+            "training_column": list(week_cols),
+            "ideal_function": [pattern_cols[idx] for idx in winners],
+            "threshold": max_dev * np.sqrt(2),
+        })
+
+    def load_csv_to_db(self, file_path, table_name, chunksize=None, memory_budget=None, layout="wide",
+                       on_chunk=None):
+        """
+        Loads a CSV file like BaseDBHandler.load_csv_to_db. Loading 'sales_patterns' also
+        builds the 'sales_patterns_stats' table from the chunks as they are written, so the
+        statistics cost no extra pass and no memory beyond one chunk. They are only
+        written when the whole file was loaded.
+        """
+        stats = PatternStats() if table_name == "sales_patterns" else None
+
+        def collect(chunk):
+            if stats is not None:
+                stats.update(chunk)
+            if on_chunk is not None:
+                on_chunk(chunk)
+
+        loaded = super().load_csv_to_db(file_path, table_name, chunksize=chunksize, memory_budget=memory_budget,
+                                        layout=layout, on_chunk=collect)
+        if loaded and stats is not None:
+            self.write_sales_table(stats.to_frame(self.table_token("sales_patterns")), self.STATS_TABLE)
+        return loaded
+
+    def build_pattern_stats(self):
+        """
+        Computes per-pattern statistics over 'sales_patterns' and stores them in the
+        'sales_patterns_stats' table: the number of defined values, their squared norm,
+        sum, min and max, and the x range on which each pattern is defined. NaN values are
+        skipped by every statistic. The rows are tagged with the pattern table's write
+        token, so they are ignored once the table is rewritten. Loading the table with
+        load_csv_to_db builds the same statistics during ingestion.
+
+        Returns:
+            pd.DataFrame: The statistics or None if the pattern table cannot be read.
+        """
+        patterns = self.read_sales_matrix("sales_patterns", dtype=np.float64)
+        if patterns is None:
             return None
+        stats = PatternStats()
+        stats.add(*patterns)
+        stats_df = stats.to_frame(self.table_token("sales_patterns"))
+        self.write_sales_table(stats_df, self.STATS_TABLE)
+        return stats_df
 
-class SalesPredictor(BaseDBHandler):
-    """
-    SalesPredictor extends BaseDBHandler to implement a forecasting system
-    for weekly sales. It selects the most suitable ideal functions based on
-    historical data using least-squares error and maps test data accordingly.
-    """
+    def load_pattern_stats(self):
+        """
+        Returns the stored pattern statistics if they describe the current 'sales_patterns'.
 
-    def identify_best_sales_patterns(self):
+        Returns:
+            pd.DataFrame: The 'sales_patterns_stats' table or None if it is missing or stale.
         """
-        Determines the best matching ideal function for each historical sales column
-        by minimizing the least squares error between values.
+        if not self.table_exists(self.STATS_TABLE):
+            return None
+        stats_df = self.read_sales_table(self.STATS_TABLE)
+        if stats_df is None or stats_df.empty or (stats_df["token"] != self.table_token("sales_patterns")).any():
+            return None
+        return stats_df
+
+    def pattern_search_stats(self, x_values):
+        """
+        Returns the stored squared norms and sums of all pattern columns for the SSE
+        search, provided they apply: the training rows must be on exactly the pattern
+        grid (no alignment) and the matrices must be float64.
+
+        Args:
+            x_values (np.ndarray): x values of the training rows.
 
         Returns:
-            dict: Mapping of historical sales columns to ideal function columns.
+            dict: 'norm_sq' and 'sum' arrays in pattern column order, or None.
+        """
+        if self.dtype != np.float64:
+            return None
+        patterns = self.read_sales_matrix("sales_patterns")
+        stats_df = self.load_pattern_stats()
+        if patterns is None or stats_df is None or not np.array_equal(x_values, patterns[0]):
+            return None
+        stats_df = stats_df.set_index("function").reindex(patterns[1])
+        # The SSE expansion needs every pattern value; patterns with gaps use the plain search.
+        if stats_df["norm_sq"].isna().any() or (stats_df["count"] != len(patterns[0])).any():
+            return None
+        return {"norm_sq": stats_df["norm_sq"].to_numpy(), "sum": stats_df["sum"].to_numpy()}
+
+    def selection_fingerprint(self):
         """
-        training_sales_df = self.read_sales_table("historical_sales")
-        pattern_df = self.read_sales_table("sales_patterns")
+        Combines the fingerprints of the historical and pattern tables, the selection
+        loss, the x alignment and the precision into the key under which a pattern selection is stored.
 
-        if training_sales_df is None or pattern_df is None:
-            logging.error("Missing historical or pattern sales data.")
-            return {}
+        Returns:
+            str: Hex SHA-256 digest or None if an input table cannot be read.
+        """
+        parts = [self.table_fingerprint("historical_sales"), self.table_fingerprint("sales_patterns")]
+        if None in parts:
+            return None
+        params = {name: np.asarray(value).tolist() for name, value in self.loss_params.items()}
+        parts.append(json.dumps({"loss": self.loss, "params": params, "align": self.align,
+                                 "align_tolerance": self.align_tolerance, "precision": self.precision},
+                                sort_keys=True))
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
 
-        best_patterns = {}
-        for week_col in training_sales_df.columns[1:]:
-            errors = {
-                pattern_col: np.sum((training_sales_df[week_col] - pattern_df[pattern_col]) ** 2)
-                for pattern_col in pattern_df.columns[1:]
-            }
-            best_patterns[week_col] = min(errors, key=errors.get)
+    def _stored_selection(self, fingerprint):
+        """
+        Returns the stored 'pattern_thresholds' table if it was computed for the given fingerprint.
 
-        return best_patterns
+        Args:
+            fingerprint (str): Expected selection fingerprint.
 
-    def load_and_predict_weekly_sales(self, file_path):
+        Returns:
+            pd.DataFrame: The stored selection or None if it is missing or stale.
         """
-        Processes the test weekly sales file to map each record to its best ideal function
-        and stores results in the database with corresponding deviation.
+        if fingerprint is None or not self.table_exists("pattern_thresholds"):
+            return None
+        stored = self.read_sales_table("pattern_thresholds")
+        if stored is None or "fingerprint" not in stored.columns or stored.empty:
+            return None
+        if (stored["fingerprint"] != fingerprint).any():
+            return None
+        return stored
+
+    def _read_accumulators(self, fingerprint):
+        """
+        Returns the stored per-pair accumulators if they were computed for the given fingerprint.
+
+        Args:
+            fingerprint (str): Expected selection fingerprint.
+
+        Returns:
+            tuple: (training columns, pattern columns, SSE matrix, max abs deviation matrix)
+                or None if they are missing or stale.
+        """
+        if fingerprint is None or not self.table_exists(self.ACCUMULATOR_TABLE):
+            return None
+        stored = self.read_sales_table(self.ACCUMULATOR_TABLE)
+        if stored is None or stored.empty or (stored["fingerprint"] != fingerprint).any():
+            return None
+        week_cols = list(dict.fromkeys(stored["training_column"]))
+        pattern_cols = list(dict.fromkeys(stored["ideal_function"]))
+        shape = (len(week_cols), len(pattern_cols))
+        if len(stored) != shape[0] * shape[1]:
+            return None
+        return (week_cols, pattern_cols, stored["sse"].to_numpy(dtype=float).reshape(shape),
+                stored["max_abs"].to_numpy(dtype=float).reshape(shape))
+
+    def load_pattern_thresholds(self):
+        """
+        Returns the stored pattern thresholds, running the pattern selection first
+        if no selection has been stored for the current data.
+
+        Returns:
+            pd.DataFrame: The 'pattern_thresholds' table or None if selection is not possible.
+        """
+        stored = self._stored_selection(self.selection_fingerprint())
+        if stored is None:
+            self.identify_best_sales_patterns()
+            stored = self._stored_selection(self.selection_fingerprint())
+        return stored
+
+    def load_pattern_index(self, pattern_cols):
+        """
+        Returns a SortedXIndex over x and the given pattern columns. The index is built
+        once and reused until 'sales_patterns' is rewritten or other columns are requested.
+
+        Args:
+            pattern_cols (list): Pattern columns to include.
+
+        Returns:
+            SortedXIndex: The index or None if the pattern table cannot be read.
+        """
+        key = (self.table_token("sales_patterns"), tuple(pattern_cols))
+        if key[0] is None or self._pattern_index[0] != key:
+            patterns = self.read_sales_matrix("sales_patterns", columns=pattern_cols)
+            if patterns is None:
+                return None
+            x_values, cols, values = patterns
+            index = SortedXIndex(x_values, values, cols, self.dtype)
+            self._pattern_index = (key, index)
+        return self._pattern_index[1]
+
+    def _map_sales_points(self, x_vals, y_vals, thresholds_df, pattern_index, x_match="exact", x_tolerance=0.0):
+        """
+        Maps a batch of test points against every selected pattern in one array pass.
+
+        Each point is assigned the pattern with the smallest deviation that stays within
+        the pattern's threshold from 'pattern_thresholds'. Ties keep the first pattern in
+        selection order, matching the original row-by-row rule.
+
+        Args:
+            x_vals (np.ndarray): Test x values.
+            y_vals (np.ndarray): Test y values.
+            thresholds_df (pd.DataFrame): Selected patterns and their thresholds.
+            pattern_index (SortedXIndex): Index over the selected pattern columns.
+            x_match (str): x lookup mode, see SortedXIndex.lookup.
+            x_tolerance (float): Largest accepted x distance for 'nearest' lookups.
+
+        Returns:
+            pd.DataFrame: Columns x, y, delta_y, ideal_function (None when unmatched).
+        """
+        selected = thresholds_df[thresholds_df["ideal_function"].isin(pattern_index.columns)]
+        x_vals = np.asarray(x_vals, dtype=float)
+        y_vals = np.asarray(y_vals, dtype=float)
+        n_points = len(x_vals)
+
+        best_match = np.full(n_points, None, dtype=object)
+        min_dev = np.full(n_points, np.inf)
+
+        if len(selected) and n_points:
+            pattern_cols = list(selected["ideal_function"])
+            max_dev = selected["threshold"].to_numpy(dtype=float)
+            values, found = self._lookup_patterns(x_vals, pattern_cols, pattern_index, x_match, x_tolerance)
+            if self.backend == "numba":
+                best_idx, min_dev = NUMBA_KERNELS["best_match"](y_vals, values, found, max_dev)
+                matched = best_idx >= 0
+            else:
+                deviation = np.abs(y_vals[:, None] - values)
+                admissible = found[:, None] & (deviation <= max_dev[None, :])
+                deviation = np.where(admissible, deviation, np.inf)
+
+                best_idx = np.argmin(deviation, axis=1)
+                matched = admissible.any(axis=1)
+                min_dev[matched] = deviation[matched, best_idx[matched]]
+            best_match[matched] = np.array(pattern_cols, dtype=object)[best_idx[matched]]
+
+        return pd.DataFrame({
+            "x": x_vals,
+            "y": y_vals,
+            "delta_y": min_dev,
+            "ideal_function": best_match,
+        })
+
+    def _map_all_sales_points(self, x_vals, y_vals, thresholds_df, pattern_index, x_match="exact", x_tolerance=0.0,
+                              point_offset=0):
+        """
+        Finds every selected pattern that admits each test point, using one admissibility
+        mask over points x patterns. A pattern selected for several historical columns is
+        listed once and admits a point within the largest of its thresholds.
+
+        Args:
+            x_vals (np.ndarray): Test x values.
+            y_vals (np.ndarray): Test y values.
+            thresholds_df (pd.DataFrame): Selected patterns and their thresholds.
+            pattern_index (SortedXIndex): Index over the selected pattern columns.
+            x_match (str): x lookup mode, see SortedXIndex.lookup.
+            x_tolerance (float): Largest accepted x distance for 'nearest' lookups.
+            point_offset (int): point_id of the first point in the batch.
+
+        Returns:
+            pd.DataFrame: Columns point_id, ideal_function, delta_y, one row per admissible
+                pair, ordered by point and then selection order.
+        """
+        selected = thresholds_df[thresholds_df["ideal_function"].isin(pattern_index.columns)]
+        max_dev = selected.groupby("ideal_function", sort=False)["threshold"].max()
+        x_vals = np.asarray(x_vals, dtype=float)
+        y_vals = np.asarray(y_vals, dtype=float)
+
+        points, patterns, deviation = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        if len(max_dev) and len(x_vals):
+            values, found = self._lookup_patterns(x_vals, list(max_dev.index), pattern_index, x_match, x_tolerance)
+            all_deviation = np.abs(y_vals[:, None] - values)
+            admissible = found[:, None] & (all_deviation <= max_dev.to_numpy(dtype=float)[None, :])
+            points, patterns = np.nonzero(admissible)
+            deviation = all_deviation[points, patterns]
+
+        return pd.DataFrame({
+            "point_id": points + point_offset,
+            "ideal_function": np.array(list(max_dev.index), dtype=object)[patterns],
+            "delta_y": deviation,
+        })
+
+    def _lookup_patterns(self, x_vals, pattern_cols, pattern_index, x_match, x_tolerance):
+        """
+        Resolves the given pattern columns at a batch of test x values.
+
+        Returns:
+            tuple: (values of shape (points, len(pattern_cols)), boolean mask of resolved points).
+        """
+        values, found = pattern_index.lookup(x_vals, x_match, x_tolerance)
+        return values[:, [pattern_index.columns.index(col) for col in pattern_cols]], found
+
+    def _read_test_chunks(self, file_path, chunksize):
+        """
+        Yields the test data in chunks with normalized column names.
 
         Args:
-            file_path (str): Path to test data CSV file.
+            file_path (str): Path to test data CSV file, or '-' for standard input.
+            chunksize (int): Rows per chunk; None yields the whole file as one chunk.
+
+        Yields:
+            pd.DataFrame: Test rows with 'x' and 'y' columns.
 
         Raises:
-            InvalidSalesDataError: If test file is missing required columns or if reference data is missing.
+            InvalidSalesDataError: If the test data is missing required columns.
+        """
+        source = sys.stdin if file_path == "-" else file_path
+        chunks = [pd.read_csv(source)] if chunksize is None else pd.read_csv(source, chunksize=chunksize)
+        for chunk in chunks:
+            chunk.columns = [col.strip().lower() for col in chunk.columns]
+            if "x" not in chunk or "y" not in chunk:
+                raise InvalidSalesDataError("Missing required columns 'x' or 'y'")
+            yield chunk
+
+    def _split_test_chunks(self, chunks, parts):
+        """
+        Splits every test chunk into up to the given number of consecutive, non-empty parts.
+
+        Yields:
+            pd.DataFrame: Consecutive row ranges of the input chunks.
+        """
+        for chunk in chunks:
+            bounds = np.linspace(0, len(chunk), parts + 1).astype(int)
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                if stop > start:
+                    yield chunk.iloc[start:stop]
+
+    def _map_test_chunks(self, chunks, thresholds_df, pattern_index, x_match, x_tolerance, assignments):
+        """
+        Maps test chunks in-process.
+
+        Yields:
+            tuple: (forecast DataFrame, assignments DataFrame or None) per chunk, in input order.
+        """
+        point_offset = 0
+        for chunk in chunks:
+            x_vals, y_vals = chunk["x"].to_numpy(), chunk["y"].to_numpy()
+            forecast_df = self._map_sales_points(x_vals, y_vals, thresholds_df, pattern_index, x_match, x_tolerance)
+            assignments_df = None
+            if assignments == "all":
+                assignments_df = self._map_all_sales_points(x_vals, y_vals, thresholds_df, pattern_index,
+                                                            x_match, x_tolerance, point_offset)
+            point_offset += len(chunk)
+            yield forecast_df, assignments_df
+
+    def _map_test_chunks_parallel(self, chunks, thresholds_df, pattern_index, x_match, x_tolerance, assignments,
+                                  workers):
+        """
+        Maps test chunks in a process pool. The pattern grid and values are placed in
+        shared memory once and attached read-only by every worker; at most two chunks per
+        worker are in flight, and results are yielded in input order.
+
+        Yields:
+            tuple: (forecast DataFrame, assignments DataFrame or None) per chunk, in input order.
         """
+        blocks = []
         try:
-            test_sales_df = pd.read_csv(file_path)
-            test_sales_df.columns = [col.strip().lower() for col in test_sales_df.columns]
+            for values in (pattern_index.x, pattern_index.values):
+                shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+                blocks.append(shm)
+                np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
 
-            if "x" not in test_sales_df or "y" not in test_sales_df:
-                raise InvalidSalesDataError("Missing required columns 'x' or 'y'")
+            initargs = (blocks[0].name, pattern_index.x.shape, blocks[1].name, pattern_index.values.shape,
+                        pattern_index.values.dtype.str, pattern_index.columns, self.backend)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_mapping_worker,
+                                     initargs=initargs) as executor:
+                pending, point_offset = [], 0
+                for chunk in chunks:
+                    pending.append(executor.submit(_map_chunk_worker, chunk["x"].to_numpy(), chunk["y"].to_numpy(),
+                                                   thresholds_df, x_match, x_tolerance, assignments, point_offset))
+                    point_offset += len(chunk)
+                    if len(pending) >= 2 * workers:
+                        yield pending.pop(0).result()
+                for future in pending:
+                    yield future.result()
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
 
-            best_patterns = self.identify_best_sales_patterns()
-            pattern_df = self.read_sales_table("sales_patterns")
-            training_df = self.read_sales_table("historical_sales")
+    def load_and_predict_weekly_sales(self, file_path, x_match="exact", x_tolerance=0.0, chunksize=None,
+                                      assignments="best", workers=None):
+        """
+        Processes the test weekly sales file to map each record to its best ideal function
+        and stores results in the database with corresponding deviation. With a chunk size
+        the input is streamed: every chunk is mapped against the cached patterns and
+        thresholds and appended to 'sales_forecast' as soon as it is processed, so memory
+        stays constant and partial results are visible while the feed is running.
 
-            if pattern_df is None or training_df is None:
-                raise InvalidSalesDataError("Missing pattern/historical data.")
+        With assignments='all', every admissible pattern of every point is additionally
+        stored in the long table 'sales_forecast_assignments' (point_id, ideal_function,
+        delta_y), where point_id is the 0-based position of the point in the test input
+        and in 'sales_forecast'.
 
-            forecast_results = []
-            for _, row in test_sales_df.iterrows():
-                x_val, y_val = row["x"], row["y"]
-                best_match, min_dev = None, float('inf')
+        With several workers the chunks are mapped by a process pool sharing one copy of
+        the pattern values; results are still written in input order. Without a chunk
+        size the input is split into one chunk per worker.
 
-                for week_col, pattern_col in best_patterns.items():
-                    if pattern_col not in pattern_df.columns:
-                        continue
+        Args:
+            file_path (str): Path to test data CSV file, or '-' to read from standard input.
+            x_match (str): How test x values are matched to the pattern grid: 'exact',
+                'nearest' (within x_tolerance) or 'linear' interpolation.
+            x_tolerance (float): Largest accepted x distance for 'nearest' matches, e.g. to
+                absorb float noise such as 0.30000001.
+            chunksize (int): Rows per chunk for streaming mode; None processes the whole file at once.
+            assignments (str): 'best' stores the closest admissible pattern per point only,
+                'all' also stores every admissible pattern.
+            workers (int): Number of processes mapping chunks; 1 maps in-process. Defaults to
+                the workers the predictor was created with.
 
-                    max_dev = max(abs(training_df[week_col] - pattern_df[pattern_col])) * np.sqrt(2)
-                    pattern_sales_vals = pattern_df.loc[pattern_df["x"] == x_val, pattern_col].values
+        Raises:
+            InvalidSalesDataError: If test file is missing required columns or if reference data is missing.
+            ValueError: If assignments is not one of ASSIGNMENT_MODES.
+        """
+        if assignments not in self.ASSIGNMENT_MODES:
+            raise ValueError(f"Unknown assignment mode: {assignments}")
+        try:
+            thresholds_df = self.load_pattern_thresholds()
+            if thresholds_df is None:
+                raise InvalidSalesDataError("Missing pattern/historical data.")
 
-                    if pattern_sales_vals.size:
-                        deviation = abs(y_val - pattern_sales_vals[0])
-                        if deviation <= max_dev and deviation < min_dev:
-                            best_match, min_dev = pattern_col, deviation
+            pattern_index = self.load_pattern_index(list(thresholds_df["ideal_function"].unique()))
+            if pattern_index is None:
+                raise InvalidSalesDataError("Missing pattern/historical data.")
 
-                forecast_results.append((x_val, y_val, min_dev, best_match))
+            workers = self.workers if workers is None else workers
+            chunks = self._read_test_chunks(file_path, chunksize)
+            if workers > 1:
+                if chunksize is None:
+                    chunks = self._split_test_chunks(chunks, workers)
+                results = self._map_test_chunks_parallel(chunks, thresholds_df, pattern_index, x_match,
+                                                         x_tolerance, assignments, workers)
+            else:
+                results = self._map_test_chunks(chunks, thresholds_df, pattern_index, x_match, x_tolerance,
+                                                assignments)
 
-            forecast_df = pd.DataFrame(forecast_results, columns=["x", "y", "delta_y", "ideal_function"])
-            forecast_df.to_sql("sales_forecast", self.engine, if_exists='replace', index=False)
+            total_rows, chunks_written = 0, 0
+            for forecast_df, assignments_df in results:
+                if_exists = 'replace' if chunks_written == 0 else 'append'
+                self.write_sales_table(forecast_df, "sales_forecast", if_exists=if_exists, build_indexes=False)
+                if assignments_df is not None:
+                    self.write_sales_table(assignments_df, self.ASSIGNMENT_TABLE, if_exists=if_exists,
+                                           build_indexes=False)
+                total_rows += len(forecast_df)
+                chunks_written += 1
+                if chunksize is not None:
+                    logging.info(f"Stored forecast for {total_rows} test points so far.")
+            if chunks_written == 0:
+                empty_df = self._map_sales_points([], [], thresholds_df, pattern_index)
+                self.write_sales_table(empty_df, "sales_forecast", build_indexes=False)
+                if assignments == "all":
+                    empty_df = self._map_all_sales_points([], [], thresholds_df, pattern_index)
+                    self.write_sales_table(empty_df, self.ASSIGNMENT_TABLE, build_indexes=False)
+            self.build_table_indexes("sales_forecast")
             logging.info("Weekly sales forecast completed and stored.")
 
         except InvalidSalesDataError as ve:
@@ -153,18 +2398,26 @@ class SalesPredictor(BaseDBHandler):
 
     def visualize_sales_forecast(self):
         """
-        Visualizes the historical sales data, selected ideal patterns, and forecast results using Bokeh.
+        Visualizes the historical sales data, selected ideal patterns with their allowed
+        deviation band, and forecast results using Bokeh.
         The output is saved to an HTML file for viewing in the browser.
         """
         training_df = self.read_sales_table("historical_sales")
-        pattern_df = self.read_sales_table("sales_patterns")
-        forecast_df = self.read_sales_table("sales_forecast")
+        forecast_df = self.read_sales_table("sales_forecast", columns=["x", "y"])
+        thresholds_df = self.load_pattern_thresholds()
+        pattern_df = None
+        if thresholds_df is not None:
+            pattern_df = self.read_sales_table(
+                "sales_patterns", columns=["x"] + list(thresholds_df["ideal_function"].unique())
+            )
 
-        if not all([training_df is not None, pattern_df is not None, forecast_df is not None]):
+        if not all([training_df is not None, pattern_df is not None, forecast_df is not None,
+                    thresholds_df is not None]):
             logging.error("Missing datasets for visualization.")
             return
 
-        best_patterns = self.identify_best_sales_patterns()
+        best_patterns = dict(zip(thresholds_df["training_column"], thresholds_df["ideal_function"]))
+        thresholds = dict(zip(thresholds_df["training_column"], thresholds_df["threshold"]))
         output_file("sales_forecast_visualization.html")
         p = figure(title="Weekly Sales Forecast", x_axis_label="x", y_axis_label="y")
 
@@ -173,6 +2426,8 @@ class SalesPredictor(BaseDBHandler):
             pattern_col = best_patterns.get(col)
             if pattern_col in pattern_df.columns:
                 p.line(pattern_df["x"], pattern_df[pattern_col], legend_label=f"Pattern {col}", line_dash="dashed")
+                p.varea(pattern_df["x"], pattern_df[pattern_col] - thresholds[col],
+                        pattern_df[pattern_col] + thresholds[col], alpha=0.1, legend_label=f"Pattern {col}")
 
         p.scatter(forecast_df["x"], forecast_df["y"], legend_label="Forecast Data", color="red")
         show(p)
@@ -201,11 +2456,712 @@ class TestSalesPredictor(unittest.TestCase):
         self.assertIsNotNone(df)
         self.assertIn("x", df.columns)
 
+    def test_read_sales_table_projection_and_filters(self):
+        """Test column projection, x-range and x-set filters of read_sales_table."""
+        df = pd.DataFrame({"x": np.arange(2000, dtype=float), "y1": np.arange(2000.0) * 2, "y2": 1.0})
+        self.predictor.write_sales_table(df, "wide")
+
+        subset = self.predictor.read_sales_table("wide", columns=["x", "y2"], x_range=(10, 12))
+        self.assertEqual(list(subset.columns), ["x", "y2"])
+        self.assertEqual(list(subset["x"]), [10.0, 11.0, 12.0])
+
+        open_ended = self.predictor.read_sales_table("wide", columns=["y1"], x_range=(None, 1))
+        self.assertEqual(list(open_ended["y1"]), [0.0, 2.0])
+
+        picked = self.predictor.read_sales_table("wide", columns=["x", "y1"], x_values=[3.0, 5.0, 99999.0])
+        self.assertEqual(list(picked["y1"]), [6.0, 10.0])
+
+        many = np.arange(0, 2000, 2, dtype=float)  # more values than fit into one IN list
+        self.assertEqual(len(self.predictor.read_sales_table("wide", columns=["y1"], x_values=many)), 1000)
+
+    def test_long_layout_round_trip(self):
+        """Test that long-layout tables read back like wide ones and select the same patterns."""
+        patterns = pd.DataFrame({"x": [1.0, 2.0, 3.0], "y10": [9.0, 19.0, 31.0], "y2": [10.0, 20.0, 30.0]})
+        self.predictor.write_sales_table(patterns, "sales_patterns", layout="long")
+        self.assertEqual(self.predictor.table_layout("sales_patterns"), ("long", ["x", "y10", "y2"]))
+        pd.testing.assert_frame_equal(self.predictor.read_sales_table("sales_patterns"), patterns)
+
+        subset = self.predictor.read_sales_table("sales_patterns", columns=["y2", "x"], x_range=(2, None))
+        self.assertEqual(subset.values.tolist(), [[20.0, 2.0], [30.0, 3.0]])
+        x, cols, values = self.predictor.read_sales_matrix("sales_patterns", columns=["y2"])
+        self.assertEqual((list(x), cols, values[:, 0].tolist()), ([1.0, 2.0, 3.0], ["y2"], [10.0, 20.0, 30.0]))
+        self.assertEqual(self.predictor.identify_best_sales_patterns(), {"y1": "y2"})
+
+        test_path = "test_dummy_long.csv"
+        patterns.to_csv(test_path, index=False)
+        self.addCleanup(os.remove, test_path)
+        self.predictor.load_csv_to_db(test_path, "streamed_long", chunksize=2, layout="long")
+        pd.testing.assert_frame_equal(self.predictor.read_sales_table("streamed_long"), patterns)
+
+        self.predictor.write_sales_table(patterns, "sales_patterns")
+        self.assertEqual(self.predictor.table_layout("sales_patterns"), ("wide", None))
+
+    def test_blob_layout_round_trip(self):
+        """Test that blob tables decode to the stored values, including appended chunks."""
+        patterns = pd.DataFrame({"x": [1.0, 2.0, 3.0], "y1": [10.0, 20.0, 30.0], "y2": [11.0, 21.0, 29.0]})
+        self.predictor.write_sales_table(patterns.iloc[:2], "sales_patterns", layout="blob")
+        self.predictor.write_sales_table(patterns.iloc[2:], "sales_patterns", if_exists='append', layout="blob")
+        pd.testing.assert_frame_equal(self.predictor.read_sales_table("sales_patterns"), patterns)
+
+        x, cols, values = self.predictor.read_sales_matrix("sales_patterns", columns=["y2"])
+        self.assertEqual((list(x), cols, values[:, 0].tolist()), ([1.0, 2.0, 3.0], ["y2"], [11.0, 21.0, 29.0]))
+        subset = self.predictor.read_sales_table("sales_patterns", columns=["x", "y1"], x_values=[3.0])
+        self.assertEqual(subset.values.tolist(), [[3.0, 30.0]])
+        self.assertEqual(self.predictor.identify_best_sales_patterns(), {"y1": "y1"})
+
+    def test_read_sales_matrix_memory_mapped_sidecar(self):
+        """Test that full matrices are shared through .npy sidecars tied to the write token."""
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        db_path = os.path.join(tmp_dir.name, "mmap.db")
+        writer = SalesPredictor(db_name=db_path)
+        self.addCleanup(writer.engine.dispose)
+        patterns = pd.DataFrame({"x": [1.0, 2.0, 3.0], "y1": [10.0, 20.0, 30.0], "y2": [1.0, 2.0, 3.0]})
+        writer.write_sales_table(patterns, "sales_patterns")
+        writer.read_sales_matrix("sales_patterns")
+        token = writer.table_token("sales_patterns")
+        self.assertTrue(os.path.exists(os.path.join(writer.matrix_dir, f"sales_patterns.{token}.values.npy")))
+
+        reader = SalesPredictor(db_name=db_path)
+        self.addCleanup(reader.engine.dispose)
+        with mock.patch.object(BaseDBHandler, "_read_matrix_from_db", side_effect=AssertionError):
+            x, cols, values = reader.read_sales_matrix("sales_patterns")
+            _, _, subset = reader.read_sales_matrix("sales_patterns", columns=["y2"])
+        self.assertIsInstance(values, np.memmap)
+        self.assertEqual((list(x), cols), ([1.0, 2.0, 3.0], ["y1", "y2"]))
+        self.assertEqual(subset[:, 0].tolist(), [1.0, 2.0, 3.0])
+
+        reader.write_sales_table(patterns.assign(y2=0.0), "sales_patterns")
+        self.assertEqual(reader.read_sales_matrix("sales_patterns")[2][:, 1].tolist(), [0.0, 0.0, 0.0])
+        self.assertEqual(len(os.listdir(reader.matrix_dir)), 3)
+
+    def test_read_sales_table_cache(self):
+        """Test that repeated reads are cached and writes through the handler invalidate them."""
+        self.predictor.write_sales_table(pd.DataFrame({"x": [1, 2, 3], "y1": [10, 20, 30]}), "historical_sales")
+        first = self.predictor.read_sales_table("historical_sales")
+        first.loc[0, "y1"] = -1
+        self.assertEqual(len(self.predictor._table_cache), 1)
+        self.assertEqual(self.predictor.read_sales_table("historical_sales")["y1"].iloc[0], 10)
+
+        self.predictor.write_sales_table(pd.DataFrame({"x": [1], "y1": [99]}), "historical_sales")
+        self.assertEqual(len(self.predictor._table_cache), 0)
+        self.assertEqual(list(self.predictor.read_sales_table("historical_sales")["y1"]), [99])
+
     def test_identify_best_sales_patterns(self):
         """Test the logic for identifying the best-matching pattern columns."""
         patterns = self.predictor.identify_best_sales_patterns()
         self.assertIsInstance(patterns, dict)
 
+    def test_sse_matrix_matches_direct_sum(self):
+        """Test the matrix-form SSE search against a direct per-pair summation."""
+        rng = np.random.default_rng(0)
+        train = rng.normal(size=(40, 3)) * 100
+        patterns = np.column_stack([rng.normal(size=(40, 20)) * 100, train[:, 1], train[:, 1]])
+        direct = np.array([[np.sum((train[:, i] - patterns[:, j]) ** 2) for j in range(patterns.shape[1])]
+                           for i in range(train.shape[1])])
+        sse = sse_matrix(train, patterns)
+        np.testing.assert_allclose(sse, direct, rtol=1e-9, atol=1e-6)
+        winners = argmin_sse(train, patterns, sse)
+        self.assertEqual(list(winners), list(np.argmin(direct, axis=1)))
+        self.assertEqual(winners[1], 20)
+
+    def test_pattern_selection_memoized_across_processes(self):
+        """Test that a stored selection is reused for unchanged data and recomputed otherwise."""
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        db_path = os.path.join(tmp_dir.name, "memo.db")
+        first = SalesPredictor(db_name=db_path)
+        self.addCleanup(first.engine.dispose)
+        first.write_sales_table(pd.DataFrame({"x": [1, 2, 3], "y1": [10, 20, 30]}), "historical_sales")
+        first.write_sales_table(pd.DataFrame({"x": [1, 2, 3], "y1": [10, 20, 30], "y2": [11, 21, 29]}),
+                                "sales_patterns")
+        self.assertEqual(first.identify_best_sales_patterns(), {"y1": "y1"})
+
+        second = SalesPredictor(db_name=db_path)
+        self.addCleanup(second.engine.dispose)
+        with mock.patch.object(SalesPredictor, "compute_pattern_thresholds", side_effect=AssertionError):
+            self.assertEqual(second.identify_best_sales_patterns(), {"y1": "y1"})
+
+        pd.DataFrame({"x": [1, 2, 3], "y1": [11, 21, 29]}).to_sql(
+            "historical_sales", second.engine, if_exists="replace", index=False)
+        second.bump_table_version("historical_sales")
+        self.assertEqual(second.identify_best_sales_patterns(), {"y1": "y2"})
+        self.assertEqual(second.load_pattern_thresholds()["sse"].iloc[0], 0.0)
+
+    def test_writes_from_another_handler_invalidate_caches(self):
+        """Test that cached reads and selections notice writes made by another handler."""
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        db_path = os.path.join(tmp_dir.name, "shared.db")
+        first, second = SalesPredictor(db_name=db_path), SalesPredictor(db_name=db_path)
+        self.addCleanup(first.engine.dispose)
+        self.addCleanup(second.engine.dispose)
+        first.write_sales_table(pd.DataFrame({"x": [1, 2, 3], "y1": [10, 20, 30], "y2": [11, 21, 29]}),
+                                "sales_patterns")
+        first.write_sales_table(pd.DataFrame({"x": [1, 2, 3], "y1": [10, 20, 30]}), "historical_sales")
+        self.assertEqual(first.identify_best_sales_patterns(), {"y1": "y1"})
+
+        second.write_sales_table(pd.DataFrame({"x": [1, 2, 3], "y1": [11, 21, 29]}), "historical_sales")
+        self.assertEqual(second.identify_best_sales_patterns(), {"y1": "y2"})
+        self.assertEqual(list(first.read_sales_table("historical_sales")["y1"]), [11, 21, 29])
+        self.assertEqual(first.identify_best_sales_patterns(), {"y1": "y2"})
+        self.assertEqual(list(second.load_pattern_thresholds()["ideal_function"]), ["y2"])
+
+    def test_write_commits_data_and_token_together(self):
+        """Test that a write whose catalog update fails leaves neither new data nor a new token."""
+        self.predictor.write_sales_table(pd.DataFrame({"x": [1], "y1": [1.0]}), "t")
+        token = self.predictor.table_token("t")
+        failing = self.predictor._catalog_statements("t", "long", ["x", "y1"]) + [("SELECT * FROM missing_table", {})]
+        with mock.patch.object(SalesPredictor, "_catalog_statements", return_value=failing):
+            with self.assertRaises(Exception):
+                self.predictor.write_sales_table(pd.DataFrame({"x": [1], "y1": [2.0]}), "t")
+        self.assertEqual(self.predictor.table_token("t"), token)
+        self.assertEqual(self.predictor.table_layout("t"), ("wide", None))
+        self.assertEqual(list(self.predictor.read_sales_table("t")["y1"]), [1])
+
+    def test_selection_notices_external_rewrites(self):
+        """Test that a stored selection is not reused after a table is replaced without the handler."""
+        patterns = pd.DataFrame({"x": [1, 2, 3], "y1": [10, 20, 30], "y2": [11, 21, 29]})
+        patterns.to_sql("sales_patterns", self.predictor.engine, index=False, if_exists="replace")
+        self.assertEqual(self.predictor.identify_best_sales_patterns(), {"y1": "y1"})
+        pd.DataFrame({"x": [1, 2, 3], "y1": [11, 21, 29]}).to_sql("historical_sales", self.predictor.engine,
+                                                                   index=False, if_exists="replace")
+        self.assertEqual(self.predictor.identify_best_sales_patterns(), {"y1": "y2"})
+
+    def test_tables_written_by_other_means_are_not_cached(self):
+        """Test that reads of tables without a write token always see the current contents."""
+        pd.DataFrame({"x": [1], "y1": [1.0]}).to_sql("t", self.predictor.engine, index=False)
+        self.assertEqual(list(self.predictor.read_sales_table("t")["y1"]), [1])
+        self.assertEqual(list(self.predictor.read_sales_matrix("t")[2][:, 0]), [1])
+        pd.DataFrame({"x": [1], "y1": [2.0]}).to_sql("t", self.predictor.engine, index=False, if_exists="replace")
+        self.assertEqual(list(self.predictor.read_sales_table("t")["y1"]), [2])
+        self.assertEqual(list(self.predictor.read_sales_matrix("t")[2][:, 0]), [2])
+        self.assertFalse(any(key[0] == "t" for key in self.predictor._table_cache))
+
+    def test_fresh_process_does_not_reread_source_tables(self):
+        """Test that a new predictor maps test data from the stored selection and sidecars only."""
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        db_path = os.path.join(tmp_dir.name, "fresh.db")
+        test_path = os.path.join(tmp_dir.name, "points.csv")
+        pd.DataFrame({"x": [1, 2], "y": [10.0, 21.0]}).to_csv(test_path, index=False)
+        first = SalesPredictor(db_name=db_path)
+        self.addCleanup(first.engine.dispose)
+        first.write_sales_table(pd.DataFrame({"x": [1, 2, 3], "y1": [10, 20, 30]}), "historical_sales")
+        first.write_sales_table(pd.DataFrame({"x": [1, 2, 3], "y1": [10, 20, 30], "y2": [11, 21, 29]}),
+                                "sales_patterns")
+        first.load_and_predict_weekly_sales(test_path)
+
+        second = SalesPredictor(db_name=db_path)
+        self.addCleanup(second.engine.dispose)
+        with mock.patch.object(SalesPredictor, "_read_wide_frame", autospec=True,
+                               side_effect=SalesPredictor._read_wide_frame) as read:
+            second.load_and_predict_weekly_sales(test_path)
+        read_tables = {call.args[1] for call in read.call_args_list}
+        self.assertFalse(read_tables & {"historical_sales", "sales_patterns"}, read_tables)
+        self.assertEqual(list(second.read_sales_table("sales_forecast")["ideal_function"].fillna("none")),
+                         ["y1", "none"])
+
+    def test_pruned_argmin_sse_matches_matrix_search(self):
+        """Test that the early-abandoning search returns the full-matrix winners, ties included."""
+        rng = np.random.default_rng(3)
+        train = rng.normal(size=(150, 3)) * 50
+        patterns = np.column_stack([rng.normal(size=(150, 600)) * 50, train[:, 1] + 0.01,
+                                    train[:, 1] + 0.01, train[:, 2]])
+        expected = argmin_sse(train, patterns, sse_matrix(train, patterns))
+        pruned = pruned_argmin_sse(train, patterns, block_rows=16, batch_size=64)
+        self.assertEqual(list(pruned), list(expected))
+        self.assertEqual(list(pruned[1:]), [600, 602])
+
+        predictor = SalesPredictor(db_name=":memory:", search="pruned")
+        predictor.write_sales_table(pd.DataFrame({"x": [1, 2, 3], "y1": [10, 20, 30]}), "historical_sales")
+        predictor.write_sales_table(pd.DataFrame({"x": [1, 2, 3], "y1": [11, 21, 29], "y2": [10, 20, 31]}),
+                                    "sales_patterns")
+        self.assertEqual(predictor.identify_best_sales_patterns(), {"y1": "y2"})
+
+    def test_selection_losses(self):
+        """Test the batched loss kernels against direct sums and their effect on the selection."""
+        rng = np.random.default_rng(4)
+        train = rng.normal(size=(30, 2))
+        patterns = rng.normal(size=(30, 5))
+        diff = train[:, :, None] - patterns[:, None, :]
+        weights = rng.uniform(size=30)
+        np.testing.assert_allclose(mae_matrix(train, patterns), np.abs(diff).sum(axis=0))
+        np.testing.assert_allclose(max_abs_matrix(train, patterns), np.abs(diff).max(axis=0))
+        np.testing.assert_allclose(weighted_sse_matrix(train, patterns, weights),
+                                   np.einsum("i,ijk->jk", weights, diff ** 2))
+        huber = np.where(np.abs(diff) <= 0.5, 0.5 * diff ** 2, 0.5 * (np.abs(diff) - 0.25)).sum(axis=0)
+        np.testing.assert_allclose(huber_matrix(train, patterns, delta=0.5), huber)
+
+        # y1 misses a single outlier by 10, y2 is off by 3 everywhere else.
+        history = pd.DataFrame({"x": [1, 2, 3, 4, 5], "y1": [0, 0, 0, 0, 10]})
+        library = pd.DataFrame({"x": [1, 2, 3, 4, 5], "y1": [0.0] * 5, "y2": [3.0] * 5})
+        expected = {"sse": "y2", "mae": "y1", "max_abs": "y2", "huber": "y1", "weighted_sse": "y1"}
+        params = {"weighted_sse": {"weights": [1, 1, 1, 1, 0]}}
+        for loss, best in expected.items():
+            predictor = SalesPredictor(db_name=":memory:", loss=loss, loss_params=params.get(loss))
+            predictor.write_sales_table(history, "historical_sales")
+            predictor.write_sales_table(library, "sales_patterns")
+            self.assertEqual(predictor.identify_best_sales_patterns(), {"y1": best}, loss)
+        with self.assertRaises(ValueError):
+            SalesPredictor(db_name=":memory:", loss="mae", search="pruned")
+        for loss, bad_params in [("weighted_sse", None), ("sse", {"delta": 1}), ("huber", {"delta": 0}),
+                                 ("weighted_sse", {"weights": [1, -1]})]:
+            with self.assertRaises(ValueError):
+                SalesPredictor(db_name=":memory:", loss=loss, loss_params=bad_params)
+
+        predictor = SalesPredictor(db_name=":memory:", loss="weighted_sse", loss_params={"weights": [1, 1]})
+        predictor.write_sales_table(history, "historical_sales")
+        predictor.write_sales_table(library, "sales_patterns")
+        self.assertEqual(predictor.identify_best_sales_patterns(), {})
+
+    def test_selection_aligns_training_and_patterns_on_x(self):
+        """Test that selection joins on x instead of row position and rejects unmatched grids."""
+        library = pd.DataFrame({"x": [1.0, 2.0, 3.0, 4.0], "y1": [10, 20, 30, 40], "y2": [40, 30, 20, 10]})
+        self.predictor.write_sales_table(library, "sales_patterns")
+        # Reversed rows match y1 by x but would match y2 by position.
+        self.predictor.write_sales_table(pd.DataFrame({"x": [4.0, 3.0, 2.0, 1.0], "y1": [40, 30, 20, 10]}),
+                                         "historical_sales")
+        self.assertEqual(self.predictor.identify_best_sales_patterns(), {"y1": "y1"})
+        self.assertEqual(self.predictor.load_pattern_thresholds()["sse"].iloc[0], 0.0)
+
+        off_grid = pd.DataFrame({"x": [1.5, 2.0, 3.5], "y1": [15, 20, 35]})
+        self.predictor.write_sales_table(off_grid, "historical_sales")
+        self.assertEqual(self.predictor.identify_best_sales_patterns(), {})
+
+        linear = SalesPredictor(db_name=":memory:", align="linear")
+        linear.write_sales_table(library, "sales_patterns")
+        linear.write_sales_table(off_grid, "historical_sales")
+        self.assertEqual(linear.identify_best_sales_patterns(), {"y1": "y1"})
+        np.testing.assert_allclose(linear.read_aligned_matrices()[3][:, 0], [15, 20, 35])
+
+    def test_append_sales_history_updates_selection_incrementally(self):
+        """Test that appended rows update the selection like a full recomputation would."""
+        rng = np.random.default_rng(5)
+        x = np.arange(12.0)
+        library = pd.DataFrame({"x": x, **{f"y{i}": rng.normal(size=12) for i in range(1, 7)}})
+        history = pd.DataFrame({"x": x, "y1": library["y2"] + 0.1, "y2": library["y5"] - 0.2})
+        history.loc[8:, "y1"] = library["y4"][8:]
+        self.predictor.write_sales_table(library, "sales_patterns")
+        self.predictor.write_sales_table(history[:4], "historical_sales")
+
+        self.assertEqual(self.predictor.append_sales_history(history[4:8]), {"y1": "y2", "y2": "y5"})
+        with mock.patch.object(SalesPredictor, "read_aligned_matrices", side_effect=AssertionError), \
+                mock.patch.object(SalesPredictor, "_read_wide_frame", autospec=True,
+                                  side_effect=SalesPredictor._read_wide_frame) as read:
+            incremental = self.predictor.append_sales_history(history[8:])
+        self.assertNotIn("historical_sales", {call.args[1] for call in read.call_args_list})
+        incremental_thresholds = self.predictor.load_pattern_thresholds()
+
+        full = SalesPredictor(db_name=":memory:")
+        full.write_sales_table(library, "sales_patterns")
+        full.write_sales_table(history, "historical_sales")
+        self.assertEqual(incremental, full.identify_best_sales_patterns())
+        np.testing.assert_allclose(incremental_thresholds[["sse", "threshold"]],
+                                   full.load_pattern_thresholds()[["sse", "threshold"]])
+        self.assertEqual(len(self.predictor.read_sales_table("historical_sales")), 12)
+
+        # In float32 mode appended rows are rounded like the rows of a full selection.
+        history[["y1", "y2"]] *= 1.001
+        incremental, full = (SalesPredictor(db_name=":memory:", precision="float32") for _ in range(2))
+        for predictor in (incremental, full):
+            predictor.write_sales_table(library, "sales_patterns")
+        incremental.write_sales_table(history[:4], "historical_sales")
+        incremental.append_sales_history(history[4:])
+        full.write_sales_table(history, "historical_sales")
+        full.identify_best_sales_patterns()
+        np.testing.assert_allclose(incremental.load_pattern_thresholds()["sse"],
+                                   full.load_pattern_thresholds()["sse"], rtol=1e-12)
+
+    def test_fused_kernels_match_numpy_backend(self):
+        """Test the loop kernels of the numba backend against the NumPy search and mapping."""
+        rng = np.random.default_rng(6)
+        train = rng.normal(size=(20, 3))
+        patterns = np.column_stack([rng.normal(size=(20, 8)), train[:, 0], train[:, 0]])
+        self.assertEqual(list(fused_argmin_sse(train, patterns)),
+                         list(argmin_sse(train, patterns, sse_matrix(train, patterns))))
+
+        kernels = {"argmin_sse": fused_argmin_sse, "best_match": fused_best_match}
+        with mock.patch(f"{__name__}.NUMBA_KERNELS", kernels):
+            jit = SalesPredictor(db_name=":memory:", backend="numba")
+        self.assertEqual(jit.backend, "numba")
+        index = SortedXIndex(np.arange(5.0), rng.normal(size=(5, 3)), ["y1", "y2", "y3"])
+        thresholds = pd.DataFrame({"ideal_function": ["y1", "y2", "y3"], "threshold": [0.5, 1.0, 0.2]})
+        x = np.array([0.0, 1.0, 2.0, 3.0, 4.0, 4.5])
+        y = rng.normal(size=6)
+        with mock.patch(f"{__name__}.NUMBA_KERNELS", kernels):
+            fused = jit._map_sales_points(x, y, thresholds, index)
+        pd.testing.assert_frame_equal(fused, self.predictor._map_sales_points(x, y, thresholds, index))
+
+    def test_float32_precision_matches_float64_on_shipped_data(self):
+        """Test that float32 matrices give the float64 pattern choices and mappings on the shipped CSVs."""
+        data_dir = os.path.dirname(os.path.abspath(__file__))
+        results = {}
+        for precision in SalesPredictor.PRECISIONS:
+            predictor = SalesPredictor(db_name=":memory:", precision=precision)
+            predictor.load_csv_to_db(os.path.join(data_dir, "train.csv"), "historical_sales")
+            predictor.load_csv_to_db(os.path.join(data_dir, "ideal.csv"), "sales_patterns")
+            patterns = predictor.identify_best_sales_patterns()
+            predictor.load_and_predict_weekly_sales(os.path.join(data_dir, "test.csv"))
+            results[precision] = (patterns, predictor.load_pattern_thresholds(),
+                                  predictor.read_sales_table("sales_forecast"),
+                                  predictor.read_aligned_matrices()[3].dtype)
+
+        self.assertEqual(results["float32"][0], results["float64"][0])
+        self.assertEqual(results["float32"][3], np.float32)
+        np.testing.assert_allclose(results["float32"][1]["threshold"], results["float64"][1]["threshold"], atol=1e-5)
+        forecast32, forecast64 = results["float32"][2], results["float64"][2]
+        pd.testing.assert_series_equal(forecast32["ideal_function"], forecast64["ideal_function"])
+        np.testing.assert_allclose(forecast32["delta_y"], forecast64["delta_y"], rtol=1e-5, atol=1e-5)
+
+    def test_float32_precision_caches_only_float32_matrices(self):
+        """Test that float32 mode caches no float64 copy of the matrices and halves the cached bytes."""
+        data_dir = os.path.dirname(os.path.abspath(__file__))
+        cached = {}
+        for precision in SalesPredictor.PRECISIONS:
+            predictor = SalesPredictor(db_name=":memory:", precision=precision)
+            predictor.load_csv_to_db(os.path.join(data_dir, "train.csv"), "historical_sales")
+            predictor.load_csv_to_db(os.path.join(data_dir, "ideal.csv"), "sales_patterns")
+            predictor.identify_best_sales_patterns()
+            entries = list(predictor._table_cache.values())
+            self.assertFalse(any(isinstance(entry, pd.DataFrame) and "x" in entry.columns for entry in entries))
+            matrices = {id(array): array for entry in entries if isinstance(entry, tuple)
+                        for array in entry if isinstance(array, np.ndarray) and array.ndim == 2}
+            self.assertEqual({array.dtype for array in matrices.values()}, {np.dtype(precision)})
+            cached[precision] = sum(array.nbytes for array in matrices.values())
+
+        self.assertEqual(cached["float32"] * 2, cached["float64"])
+
+    def test_identify_store_sales_patterns(self):
+        """Test that stacked multi-store selection matches a separate selection per store."""
+        rng = np.random.default_rng(7)
+        library = pd.DataFrame({"x": np.arange(10.0), **{f"y{i}": rng.normal(size=10) for i in range(1, 9)}})
+        stores = {
+            "north": pd.DataFrame({"x": library["x"], "y1": library["y3"] + 0.1, "y2": library["y7"]}),
+            "south": pd.DataFrame({"x": library["x"], "y1": library["y5"] - 0.1, "y2": library["y3"]}),
+            "east": pd.DataFrame({"x": library["x"][::2], "y1": library["y8"][::2]}),
+        }
+        self.predictor.write_sales_table(library, "sales_patterns")
+
+        expected = {}
+        for store_id, training in stores.items():
+            single = SalesPredictor(db_name=":memory:")
+            single.write_sales_table(library, "sales_patterns")
+            single.write_sales_table(training, "historical_sales")
+            expected[store_id] = single.identify_best_sales_patterns()
+
+        with mock.patch.object(SalesPredictor, "_search_patterns", autospec=True,
+                               side_effect=SalesPredictor._search_patterns) as search:
+            result = self.predictor.identify_store_sales_patterns(stores)
+        self.assertEqual(result, expected)
+        self.assertEqual(search.call_count, 2)
+        stored = self.predictor.read_sales_table("store_pattern_thresholds")
+        self.assertEqual(list(stored["store_id"]), ["north", "north", "south", "south", "east"])
+
+        tall = pd.concat([frame.assign(store_id=store_id) for store_id, frame in stores.items()])
+        self.assertEqual(self.predictor.identify_store_sales_patterns(tall), expected)
+
+    def test_identify_store_sales_patterns_reports_failing_stores(self):
+        """Test that stores whose grid cannot be searched are skipped without dropping the batch."""
+        rng = np.random.default_rng(11)
+        library = pd.DataFrame({"x": np.arange(10.0), **{f"y{i}": rng.normal(size=10) for i in range(1, 5)}})
+        stores = {
+            "north": pd.DataFrame({"x": library["x"], "y1": library["y3"]}),
+            "east": pd.DataFrame({"x": library["x"][::2], "y1": library["y2"][::2]}),
+            "west": pd.DataFrame({"x": library["x"] + 0.5, "y1": library["y4"]}),
+            "south": "missing_table",
+        }
+        predictor = SalesPredictor(db_name=":memory:", loss="weighted_sse", loss_params={"weights": np.ones(10)})
+        predictor.write_sales_table(library, "sales_patterns")
+
+        with self.assertLogs(level="INFO") as logs:
+            result = predictor.identify_store_sales_patterns(stores)
+        self.assertEqual(result, {"north": {"y1": "y3"}})
+        self.assertEqual(list(predictor.read_sales_table("store_pattern_thresholds")["store_id"]), ["north"])
+        failed = "\n".join(line for line in logs.output if line.startswith("ERROR"))
+        for store_id in ("east", "west", "south"):
+            self.assertIn(store_id, failed)
+        self.assertIn("Selected patterns for 1 stores in 1 stacked searches.", "\n".join(logs.output))
+
+    def test_pattern_stats_table_built_at_ingest(self):
+        """Test that loading patterns builds the stats table and that it drives the SSE search."""
+        test_path = "test_dummy_patterns.csv"
+        pd.DataFrame({"x": [1, 2, 3], "y1": [11, 21, 31], "y2": [10, 20, np.nan]}).to_csv(test_path, index=False)
+        self.addCleanup(os.remove, test_path)
+        with mock.patch.object(SalesPredictor, "read_sales_matrix") as read_matrix:
+            self.predictor.load_csv_to_db(test_path, "sales_patterns", chunksize=2)
+        read_matrix.assert_not_called()
+        self.assertFalse(any(key[0] == "sales_patterns" for key in self.predictor._table_cache))
+        stats = self.predictor.load_pattern_stats()
+        self.assertEqual(list(stats["function"]), ["y1", "y2"])
+        self.assertEqual(stats["norm_sq"].iloc[0], 121 + 441 + 961)
+        self.assertEqual(list(stats.iloc[0][["count", "sum", "min", "max", "x_min", "x_max"]]), [3, 63, 11, 31, 1, 3])
+        # NaN values are skipped by every statistic, not only by the x range.
+        self.assertEqual(list(stats.iloc[1][["count", "norm_sq", "sum", "min", "max", "x_min", "x_max"]]),
+                         [2, 500, 30, 10, 20, 1, 2])
+        self.assertIsNone(self.predictor.pattern_search_stats(np.array([1.0, 2.0, 3.0])))
+        pd.testing.assert_frame_equal(self.predictor.build_pattern_stats(), stats)
+
+        # A load that fails part-way through leaves no statistics for the partial table.
+        with open(test_path, "w") as handle:
+            handle.write('x,y1,y2\n1,11,10\n2,21,20\n3,"31,30\n')
+        self.assertFalse(self.predictor.load_csv_to_db(test_path, "sales_patterns", chunksize=2))
+        self.assertIsNone(self.predictor.load_pattern_stats())
+
+        self.predictor.write_sales_table(pd.DataFrame({"x": [1, 2, 3], "y1": [11, 21, 29], "y2": [10, 20, 30]}),
+                                         "sales_patterns")
+        self.assertIsNone(self.predictor.load_pattern_stats())
+        self.predictor.build_pattern_stats()
+        search_stats = self.predictor.pattern_search_stats(np.array([1.0, 2.0, 3.0]))
+        self.assertEqual(list(search_stats["norm_sq"]), [1403.0, 1400.0])
+        self.assertIsNone(self.predictor.pattern_search_stats(np.array([1.0, 2.0])))
+        with mock.patch(f"{__name__}.sse_matrix", wraps=sse_matrix) as matrix:
+            self.assertEqual(self.predictor.identify_best_sales_patterns(), {"y1": "y2"})
+        np.testing.assert_array_equal(matrix.call_args.args[2], [1403.0, 1400.0])
+
+        rng = np.random.default_rng(8)
+        train = rng.normal(size=(50, 2)) + 3
+        patterns = np.column_stack([rng.normal(size=(50, 300)) + rng.normal(size=300) * 3, train[:, 0] + 0.5])
+        pruned = pruned_argmin_sse(train, patterns, pattern_sq_norms=np.einsum("ij,ij->j", patterns, patterns),
+                                   pattern_sums=patterns.sum(axis=0))
+        self.assertEqual(list(pruned), list(argmin_sse(train, patterns, sse_matrix(train, patterns))))
+
+    def test_pairwise_loss_blocks_respect_memory_budget(self):
+        """Test that loss blocks stay within the byte budget for many stacked training columns."""
+        rng = np.random.default_rng(11)
+        train, patterns = rng.normal(size=(40, 30)), rng.normal(size=(40, 25))
+        shapes = []
+
+        def reduce(diff):
+            shapes.append(diff.shape)
+            return np.abs(diff).sum(axis=0)
+
+        losses = _pairwise_loss(train, patterns, reduce, block_bytes=40 * 8 * 12)
+        np.testing.assert_allclose(losses, mae_matrix(train, patterns))
+        self.assertLessEqual(max(rows * cols * block for rows, cols, block in shapes), 12 * 40)
+
+    def test_parallel_argmin_sse_matches_serial(self):
+        """Test that the sharded process-pool search returns the serial winners."""
+        rng = np.random.default_rng(1)
+        train = rng.normal(size=(30, 4))
+        # Exact duplicates of training column 2 straddle the shard boundary at column 8.
+        patterns = np.column_stack([rng.normal(size=(30, 7)), train[:, 2], train[:, 2],
+                                    rng.normal(size=(30, 2)), train[:, 0]])
+        serial = argmin_sse(train, patterns, sse_matrix(train, patterns))
+        parallel = parallel_argmin_sse(train, patterns, workers=3)
+        self.assertEqual(list(parallel), list(serial))
+        self.assertEqual(parallel[2], 7)
+
+    def test_identify_top_sales_patterns(self):
+        """Test that the top-k candidates are ranked by SSE and agree with the best pattern."""
+        rng = np.random.default_rng(2)
+        train = rng.normal(size=(25, 2))
+        patterns = rng.normal(size=(25, 12))
+        indices, sse = top_k_sse(train, patterns, 4)
+        direct = ((train[:, :, None] - patterns[:, None, :]) ** 2).sum(axis=0)
+        self.assertEqual(indices.tolist(), np.argsort(direct, axis=1)[:, :4].tolist())
+        np.testing.assert_allclose(sse, np.sort(direct, axis=1)[:, :4])
+
+        self.predictor.write_sales_table(
+            pd.DataFrame({"x": [1, 2, 3], "y1": [11, 21, 31], "y2": [10, 20, 30], "y3": [12, 20, 30]}),
+            "sales_patterns")
+        candidates = self.predictor.identify_top_sales_patterns(k=5, store=True)
+        self.assertEqual(list(candidates["ideal_function"]), ["y2", "y1", "y3"])
+        self.assertEqual(list(candidates["sse"]), [0.0, 3.0, 4.0])
+        self.assertEqual(len(self.predictor.read_sales_table("sales_pattern_candidates")), 3)
+
+        with mock.patch(f"{__name__}.sse_matrix") as matrix:
+            indices, sse = top_k_sse(train, patterns, 0)
+        matrix.assert_not_called()
+        self.assertEqual((indices.shape, sse.shape), ((2, 0), (2, 0)))
+        with self.assertRaisesRegex(ValueError, "non-negative"):
+            self.predictor.identify_top_sales_patterns(k=-1)
+
+    def test_top_k_sse_ties_match_argmin_sse(self):
+        """Test that tied candidates at the k-th boundary resolve to the lowest columns."""
+        rng = np.random.default_rng(10)
+        for _ in range(50):
+            train = rng.normal(size=(20, 3)) * rng.uniform(1, 1000)
+            duplicates = train[:, rng.integers(0, 3, 6)] + rng.choice([0.0, 1e-3], 6)
+            patterns = rng.permutation(np.column_stack([rng.normal(size=(20, 10)), duplicates]), axis=1)
+            indices, sse = top_k_sse(train, patterns, 2)
+            exact = ((train[:, :, None] - patterns[:, None, :]) ** 2).sum(axis=0)
+            self.assertEqual(list(indices[:, 0]), list(argmin_sse(train, patterns, sse_matrix(train, patterns))))
+            ranked = np.lexsort((np.tile(np.arange(16), (3, 1)), exact), axis=1)
+            self.assertEqual(indices.tolist(), ranked[:, :2].tolist())
+            np.testing.assert_allclose(sse, np.take_along_axis(exact, ranked[:, :2], axis=1))
+
+    def test_pattern_thresholds_stored_and_invalidated(self):
+        """Test that selection stores thresholds and reloading a source table makes them stale."""
+        self.predictor.identify_best_sales_patterns()
+        thresholds = self.predictor.read_sales_table("pattern_thresholds")
+        self.assertEqual(list(thresholds["ideal_function"]), ["y1"])
+        self.assertEqual(thresholds["threshold"].iloc[0], 0.0)
+
+        test_path = "test_dummy_train.csv"
+        pd.DataFrame({"x": [1, 2, 3], "y1": [11, 20, 30]}).to_csv(test_path, index=False)
+        self.addCleanup(os.remove, test_path)
+        self.predictor.load_csv_to_db(test_path, "historical_sales")
+        self.assertIsNone(self.predictor._stored_selection(self.predictor.selection_fingerprint()))
+        thresholds = self.predictor.load_pattern_thresholds()
+        self.assertAlmostEqual(thresholds["threshold"].iloc[0], np.sqrt(2))
+
+    def test_load_csv_to_db_streaming(self):
+        """Test chunked CSV ingestion with an explicit chunk size and a memory budget."""
+        test_path = "test_dummy_stream.csv"
+        expected = pd.DataFrame({"x": [1.0, 2.0, 3.0, 4.0, 5.0], "y": [5.0, 4.0, 3.0, 2.0, 1.0]})
+        expected.to_csv(test_path, index=False)
+        self.addCleanup(os.remove, test_path)
+
+        self.predictor.load_csv_to_db(test_path, "streamed", chunksize=2)
+        pd.testing.assert_frame_equal(self.predictor.read_sales_table("streamed"), expected)
+
+        self.assertEqual(self.predictor.chunksize_for_budget(test_path, 2 * 3 * BaseDBHandler.BYTES_PER_CELL), 3)
+        self.predictor.load_csv_to_db(test_path, "streamed", memory_budget=1)
+        pd.testing.assert_frame_equal(self.predictor.read_sales_table("streamed"), expected)
+
+    def test_write_sales_table_bulk(self):
+        """Test the SQLite bulk-load path across full and partial batches, appends and NULLs."""
+        n_rows = BaseDBHandler.SQLITE_MAX_VARIABLES  # three columns -> several full batches plus a remainder
+        df = pd.DataFrame({
+            "x": np.arange(n_rows, dtype=float),
+            "count": np.arange(n_rows),
+            "label": ["a", None] * (n_rows // 2) + ["b"],
+        })
+        self.predictor.write_sales_table(df, "bulk")
+        self.predictor.write_sales_table(df.iloc[:5], "bulk", if_exists='append')
+        stored = self.predictor.read_sales_table("bulk")
+        self.assertEqual(len(stored), n_rows + 5)
+        self.assertEqual(stored["count"].sum(), df["count"].sum() + 10)
+        self.assertEqual(stored["label"].isna().sum(), n_rows // 2 + 2)
+        indexes = inspect(self.predictor.engine).get_indexes("bulk")
+        self.assertEqual([ix["column_names"] for ix in indexes], [["x"]])
+
+        # Only CSV ingestion relaxes journaling; metadata and result writes stay durable.
+        test_path = "test_dummy_fast_load.csv"
+        df.to_csv(test_path, index=False)
+        self.addCleanup(os.remove, test_path)
+        with mock.patch.object(BaseDBHandler, "_bulk_insert_sqlite", autospec=True,
+                               side_effect=BaseDBHandler._bulk_insert_sqlite) as insert:
+            self.predictor.load_csv_to_db(test_path, "bulk", chunksize=n_rows // 2)
+            self.predictor.write_sales_table(df.iloc[:5], "bulk_result")
+        self.assertEqual([(call.args[2], call.args[4]) for call in insert.call_args_list],
+                         [("bulk", True)] * 3 + [("bulk_result", False)])
+
+    def test_load_and_predict_weekly_sales_streaming(self):
+        """Test that streamed mapping from a file or stdin matches the batch result."""
+        test_path = "test_dummy_stream_points.csv"
+        points = pd.DataFrame({"x": [1, 2, 3, 3, 1], "y": [10.0, 25.0, 31.0, 30.0, 12.0]})
+        points.to_csv(test_path, index=False)
+        self.addCleanup(os.remove, test_path)
+
+        self.predictor.load_and_predict_weekly_sales(test_path)
+        expected = self.predictor.read_sales_table("sales_forecast")
+        self.predictor.load_and_predict_weekly_sales(test_path, chunksize=2)
+        pd.testing.assert_frame_equal(self.predictor.read_sales_table("sales_forecast"), expected)
+
+        with mock.patch("sys.stdin", io.StringIO(points.to_csv(index=False))):
+            self.predictor.load_and_predict_weekly_sales("-", chunksize=3)
+        pd.testing.assert_frame_equal(self.predictor.read_sales_table("sales_forecast"), expected)
+
+    def test_load_and_predict_all_assignments(self):
+        """Test that the multi-assignment mode stores every admissible pattern per point."""
+        test_path = "test_dummy_all_points.csv"
+        pd.DataFrame({"x": [1, 2, 3, 9], "y": [10.5, 25.0, 30.0, 1.0]}).to_csv(test_path, index=False)
+        self.addCleanup(os.remove, test_path)
+        self.predictor.write_sales_table(pd.DataFrame({"x": [1, 2, 3], "y1": [10, 20, 30], "y2": [11, 21, 29]}),
+                                         "historical_sales")
+        self.predictor.write_sales_table(pd.DataFrame({"x": [1, 2, 3], "y1": [11, 21, 31], "y2": [10, 20, 30]}),
+                                         "sales_patterns")
+        self.predictor.write_sales_table(pd.DataFrame({
+            "training_column": ["y1", "y2"], "ideal_function": ["y2", "y1"], "sse": 0.0,
+            "threshold": [1.0, 2.0], "fingerprint": self.predictor.selection_fingerprint()}), "pattern_thresholds")
+
+        self.predictor.load_and_predict_weekly_sales(test_path, chunksize=2, assignments="all")
+        assignments = self.predictor.read_sales_table("sales_forecast_assignments")
+        self.assertEqual(list(assignments["point_id"]), [0, 0, 2, 2])
+        self.assertEqual(list(assignments["ideal_function"]), ["y2", "y1", "y2", "y1"])
+        self.assertEqual(list(assignments["delta_y"]), [0.5, 0.5, 0.0, 1.0])
+        forecast = self.predictor.read_sales_table("sales_forecast")
+        self.assertEqual(list(forecast["ideal_function"].fillna("none")), ["y2", "none", "y2", "none"])
+        with self.assertRaises(ValueError):
+            self.predictor.load_and_predict_weekly_sales(test_path, assignments="any")
+
+    def test_load_and_predict_weekly_sales_parallel(self):
+        """Test that mapping chunks in a process pool stores the in-process results in input order."""
+        rng = np.random.default_rng(9)
+        test_path = "test_dummy_parallel_points.csv"
+        pd.DataFrame({"x": rng.integers(0, 5, 300), "y": rng.normal(scale=2, size=300)}).to_csv(test_path, index=False)
+        self.addCleanup(os.remove, test_path)
+        self.predictor.write_sales_table(pd.DataFrame({"x": np.arange(5.0), "y1": rng.normal(size=5)}),
+                                         "historical_sales")
+        self.predictor.write_sales_table(pd.DataFrame({"x": np.arange(5.0), **{f"y{i}": rng.normal(size=5)
+                                                                                 for i in range(1, 6)}}),
+                                         "sales_patterns")
+
+        results = {}
+        for workers, chunksize in [(1, None), (3, None), (2, 70)]:
+            self.predictor.load_and_predict_weekly_sales(test_path, chunksize=chunksize, assignments="all",
+                                                         workers=workers)
+            results[workers, chunksize] = (self.predictor.read_sales_table("sales_forecast"),
+                                           self.predictor.read_sales_table("sales_forecast_assignments"))
+        # Without an explicit count the predictor's workers are used.
+        self.predictor.workers = 2
+        with mock.patch.object(SalesPredictor, "_map_test_chunks_parallel", autospec=True,
+                               side_effect=SalesPredictor._map_test_chunks_parallel) as mapped:
+            self.predictor.load_and_predict_weekly_sales(test_path, assignments="all")
+        self.assertEqual(mapped.call_args.args[-1], 2)
+        results["default", None] = (self.predictor.read_sales_table("sales_forecast"),
+                                    self.predictor.read_sales_table("sales_forecast_assignments"))
+        expected_forecast, expected_assignments = results[1, None]
+        self.assertEqual(len(expected_forecast), 300)
+        self.assertGreater(len(expected_assignments), 0)
+        for forecast, assignments in list(results.values())[1:]:
+            pd.testing.assert_frame_equal(forecast, expected_forecast)
+            pd.testing.assert_frame_equal(assignments, expected_assignments)
+
+    def test_mapping_worker_views_are_read_only(self):
+        """Test that mapping workers attach the shared pattern arrays as read-only views."""
+        x_values, values = np.arange(3.0), np.ones((3, 2), dtype=np.float32)
+        blocks = []
+        for array in (x_values, values):
+            shm = shared_memory.SharedMemory(create=True, size=array.nbytes)
+            self.addCleanup(shm.unlink)
+            self.addCleanup(shm.close)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+            blocks.append(shm)
+        self.addCleanup(_MAPPING_WORKER.clear)
+        _init_mapping_worker(blocks[0].name, x_values.shape, blocks[1].name, values.shape, np.float32,
+                             ["y1", "y2"], "numpy")
+        index = _MAPPING_WORKER["index"]
+        for view in (index.x, index.values):
+            self.assertFalse(view.flags.writeable)
+        with self.assertRaises(ValueError):
+            index.values[0, 0] = 2.0
+        for shm in _MAPPING_WORKER.pop("shared"):
+            shm.close()
+
+    def test_sorted_x_index_lookup_modes(self):
+        """Test exact, nearest and linear lookups of the sorted x index."""
+        index = SortedXIndex([0.3, 0.1, 0.2, 0.2], [[3.0], [1.0], [2.0], [9.0]], ["y1"])
+        query = [0.2, 0.30000001, 0.15, 0.5]
+
+        values, found = index.lookup(query)
+        self.assertEqual(list(found), [True, False, False, False])
+        self.assertEqual(values[0, 0], 2.0)
+
+        values, found = index.lookup(query, "nearest", tolerance=1e-6)
+        self.assertEqual(list(found), [True, True, False, False])
+        self.assertEqual(values[1, 0], 3.0)
+
+        values, found = index.lookup(query, "linear")
+        self.assertEqual(list(found), [True, False, True, False])
+        self.assertAlmostEqual(values[2, 0], 1.5)
+        self.assertEqual(values[0, 0], 2.0)
+
+        with self.assertRaises(ValueError):
+            index.lookup(query, "cubic")
+
     def test_load_csv_to_db(self):
         """Test loading a dummy CSV file into the database."""
         test_path = "test_dummy.csv"
@@ -214,5 +3170,25 @@ class TestSalesPredictor(unittest.TestCase):
         df = self.predictor.read_sales_table("dummy")
         self.assertEqual(df.shape[0], 1)
 
+    def test_load_and_predict_weekly_sales(self):
+        """Test that test points are mapped within the allowed deviation only."""
+        test_path = "test_dummy_points.csv"
+        pd.DataFrame({"x": [1, 2, 3, 4], "y": [10.0, 25.0, 31.0, 5.0]}).to_csv(test_path, index=False)
+        self.addCleanup(os.remove, test_path)
+        patterns = pd.DataFrame({"x": [1, 2, 3], "y1": [11, 21, 31], "y2": [10, 26, 30]})
+        patterns.to_sql("sales_patterns", self.predictor.engine, if_exists="replace", index=False)
+        self.predictor.load_and_predict_weekly_sales(test_path)
+        df = self.predictor.read_sales_table("sales_forecast")
+        self.assertEqual(list(df["ideal_function"].fillna("none")), ["y1", "none", "y1", "none"])
+        self.assertEqual(list(df["delta_y"]), [1.0, np.inf, 0.0, np.inf])
+
+        pd.DataFrame({"x": [1.0000001, 2.5], "y": [11.0, 25.0]}).to_csv(test_path, index=False)
+        self.predictor.load_and_predict_weekly_sales(test_path, x_match="nearest", x_tolerance=1e-6)
+        df = self.predictor.read_sales_table("sales_forecast")
+        self.assertEqual(list(df["ideal_function"].fillna("none")), ["y1", "none"])
+        self.predictor.load_and_predict_weekly_sales(test_path, x_match="linear")
+        df = self.predictor.read_sales_table("sales_forecast")
+        self.assertEqual(list(df["ideal_function"].fillna("none")), ["y1", "y1"])
+
 if __name__ == "__main__":
     unittest.main(argv=[''], exit=False)
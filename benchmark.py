@@ -0,0 +1,126 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from Task import NUMBA_KERNELS, SalesPredictor, SortedXIndex, argmin_sse, pruned_argmin_sse, sse_matrix
+
+
+def bench_bulk_insert(rows=100_000, cols=51):
+    """
+    Compares plain DataFrame.to_sql against the SQLite bulk-load path of
+    BaseDBHandler.write_sales_table on a file-backed database.
+
+    Args:
+        rows (int): Number of rows to write.
+        cols (int): Number of columns (x plus cols - 1 pattern columns).
+
+    Returns:
+        dict: Seconds taken by each path.
+    """
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(rows, cols)), columns=["x"] + [f"y{i}" for i in range(1, cols)])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        predictor = SalesPredictor(db_name=os.path.join(tmp_dir, "bench.db"))
+
+        start = time.perf_counter()
+        df.to_sql("bench_to_sql", predictor.engine, if_exists='replace', index=False)
+        to_sql_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        predictor.write_sales_table(df, "bench_bulk", fast_load=True)
+        bulk_seconds = time.perf_counter() - start
+        predictor.engine.dispose()
+
+    print(f"bulk insert {rows}x{cols}: to_sql {to_sql_seconds:.2f}s, "
+          f"bulk {bulk_seconds:.2f}s, speedup {to_sql_seconds / bulk_seconds:.1f}x")
+    return {"to_sql": to_sql_seconds, "bulk": bulk_seconds}
+
+
+def bench_pattern_search(rows=400, patterns=50_000, train_cols=4):
+    """
+    Compares the full SSE-matrix search against the early-abandoning pruned search
+    on a synthetic pattern library.
+
+    Args:
+        rows (int): Number of x values.
+        patterns (int): Number of candidate pattern columns.
+        train_cols (int): Number of training columns.
+
+    Returns:
+        dict: Seconds taken by each search.
+    """
+    rng = np.random.default_rng(0)
+    pattern_values = rng.normal(size=(rows, patterns)).cumsum(axis=0)
+    train_values = pattern_values[:, rng.choice(patterns, train_cols)] + rng.normal(scale=0.1, size=(rows, train_cols))
+
+    start = time.perf_counter()
+    expected = argmin_sse(train_values, pattern_values, sse_matrix(train_values, pattern_values))
+    matrix_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pruned = pruned_argmin_sse(train_values, pattern_values)
+    pruned_seconds = time.perf_counter() - start
+    assert (pruned == expected).all()
+
+    # Statistics as stored in sales_patterns_stats at ingest time.
+    norm_sq, sums = np.einsum("ij,ij->j", pattern_values, pattern_values), pattern_values.sum(axis=0)
+    start = time.perf_counter()
+    pruned = pruned_argmin_sse(train_values, pattern_values, pattern_sq_norms=norm_sq, pattern_sums=sums)
+    stats_seconds = time.perf_counter() - start
+    assert (pruned == expected).all()
+
+    print(f"pattern search {rows}x{patterns}: matrix {matrix_seconds:.2f}s, pruned {pruned_seconds:.2f}s, "
+          f"pruned with stored stats {stats_seconds:.2f}s")
+    return {"matrix": matrix_seconds, "pruned": pruned_seconds, "pruned_stats": stats_seconds}
+
+
+def bench_backends(rows=400, patterns=5_000, train_cols=4, points=1_000_000):
+    """
+    Compares the NumPy and numba backends of SalesPredictor on the pattern search and
+    the test point mapping. The numba backend is skipped when numba is not installed.
+
+    Args:
+        rows (int): Number of x values.
+        patterns (int): Number of candidate pattern columns.
+        train_cols (int): Number of training (and selected pattern) columns.
+        points (int): Number of test points to map.
+
+    Returns:
+        dict: Seconds taken by each backend as (search, mapping).
+    """
+    rng = np.random.default_rng(0)
+    pattern_values = rng.normal(size=(rows, patterns)).cumsum(axis=0)
+    train_values = pattern_values[:, rng.choice(patterns, train_cols)] + rng.normal(scale=0.1, size=(rows, train_cols))
+    cols = [f"y{i}" for i in range(1, train_cols + 1)]
+    index = SortedXIndex(np.arange(rows, dtype=float), pattern_values[:, :train_cols], cols)
+    thresholds = pd.DataFrame({"ideal_function": cols, "threshold": 0.5})
+    x = rng.integers(0, rows, points).astype(float)
+    y = pattern_values[x.astype(int), 0] + rng.normal(scale=0.5, size=points)
+
+    timings = {}
+    for backend in ("numpy", "numba") if NUMBA_KERNELS is not None else ("numpy",):
+        predictor = SalesPredictor(db_name=":memory:", backend=backend)
+        # The first call of each kernel includes JIT compilation, so the second is timed.
+        for _ in range(2):
+            start = time.perf_counter()
+            predictor._search_patterns(train_values, pattern_values)
+            search_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            predictor._map_sales_points(x, y, thresholds, index)
+            timings[backend] = (search_seconds, time.perf_counter() - start)
+        print(f"{backend} backend: search {timings[backend][0]:.3f}s, "
+              f"mapping {points} points {timings[backend][1]:.2f}s")
+    if NUMBA_KERNELS is None:
+        print("numba backend skipped: numba is not installed")
+    return timings
+
+
+if __name__ == "__main__":
+    bench_bulk_insert()
+    bench_pattern_search()
+    bench_backends()